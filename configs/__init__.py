@@ -2,9 +2,10 @@
 from dotenv import load_dotenv
 from os import getenv
 from pathlib import Path
+from typing import NamedTuple
 import json
 
-__all__ = ["configs"]
+__all__ = ["configs", "ServerSource"]
 
 
 # Raised if something is wrong when we load the config file.
@@ -12,6 +13,27 @@ class ConfigurationFileException(Exception):
     pass
 
 
+class ServerSource(NamedTuple):
+    """A DCS server polled by the server_data process"""
+    id: str             # Short unique name, used as the key in server_data frames and /info
+    kind: str           # Which getter handles the endpoint, "hoggit" or "limakilo"
+    endpoint: str       # URL of the server's status data
+    name: str           # Display name
+    interval: float = 120     # Base seconds between polls
+
+
+DEFAULT_SERVERS = [
+    {"id": "gaw", "kind": "hoggit", "endpoint": "https://statecache.hoggitworld.com/gaw",
+     "name": "Hoggit - Georgia At War"},
+    {"id": "pgaw", "kind": "hoggit", "endpoint": "https://statecache.hoggitworld.com/pgaw",
+     "name": "Hoggit - Persian Gulf At War"},
+    {"id": "lkeu", "kind": "limakilo", "endpoint": "https://levant.eu.limakilo.net/status/data",
+     "name": "Lima Kilo - Flashpoint Levant - EU"},
+    {"id": "lkna", "kind": "limakilo", "endpoint": "https://levant.na.limakilo.net/status/data",
+     "name": "Lima Kilo - Flashpoint Levant - NA"}
+]
+
+
 class _ConfigReader:
     def __init__(self):
         config_parent = Path(__file__).parent
@@ -43,10 +65,33 @@ class _ConfigReader:
         load_dotenv(config_parent / ".env")
 
         self.owner_ids: list = cfg["OWNER_IDS"]
+        self.servers: list[ServerSource] = self._load_servers(cfg.get("SERVERS", DEFAULT_SERVERS))
+        self.poller_workers: int = cfg.get("POLLER_WORKERS", 8)
+        self.db_pool_size: int = cfg.get("DB_POOL_SIZE", 4)
+        self.poller_db_pool_size: int = cfg.get("POLLER_DB_POOL_SIZE", 2)
+        self.db_backend: str = cfg.get("DB_BACKEND", "mysql")   # "mysql" or "sqlite"
+        self.sqlite_path: Path = config_parent.parent / cfg.get("SQLITE_PATH", "towerbot.db")
+        self.slow_query_ms: float = cfg.get("SLOW_QUERY_MS", 250)     # Queries slower than this are logged
         self.TOKEN: str = getenv("TOKEN")
         self.DBINFO: dict[str: str] = {"host": getenv("DBIP"), "user": getenv("DBUN"),
                                        "password": getenv("DBPW"), "database": getenv("DBNAME")}
 
 
+    @staticmethod
+    def _load_servers(server_cfgs: list[dict]) -> list[ServerSource]:
+        """Builds the server source registry, falling back to the default servers if any entry is invalid"""
+        try:
+            servers = [ServerSource(**server_cfg) for server_cfg in server_cfgs]
+            if len({server.id for server in servers}) != len(servers):
+                raise ConfigurationFileException("Duplicate server ids")
+            for server in servers:
+                if server.kind not in {"hoggit", "limakilo"}:
+                    raise ConfigurationFileException(f"Unknown server kind {server.kind}")
+        except (TypeError, ConfigurationFileException) as e:
+            print(f"{str(e)} while loading SERVERS from config.json, using default servers")
+            return [ServerSource(**server_cfg) for server_cfg in DEFAULT_SERVERS]
+        return servers
+
+
 if __name__ != "__main__":
     configs = _ConfigReader()
@@ -0,0 +1,217 @@
+"""Storage backends for tb_db, chosen with DB_BACKEND in config.json"""
+from functools import lru_cache
+from pathlib import Path
+from pymysql.constants.SERVER_STATUS import SERVER_STATUS_IN_TRANS
+import pymysql
+import re
+import sqlite3
+
+__all__ = ["Backend", "make_backend", "MySQLBackend", "SQLiteBackend"]
+
+
+class Backend:
+	"""
+	Makes connections for tb_db's pool. Connections must behave like pymysql's: cursors are context managers whose
+	execute returns the rows affected, begin/commit/rollback/ping exist and server_status flags open transactions.
+	"""
+	name = ""
+
+	def connect(self):
+		raise NotImplementedError
+
+	def retryable(self, err: Exception) -> bool:
+		"""Whether err aborted a transaction that can simply be run again, ex. to break a deadlock"""
+		return False
+
+
+class MySQLBackend(Backend):
+	name = "mysql"
+	deadlock_errors = {1205, 1213}  # Lock wait timeout exceeded, deadlock found
+
+	def __init__(self, host: str, user: str, password: str, database: str):
+		self.host = host
+		self.user = user
+		self.password = password
+		self.database = database
+
+	def connect(self) -> pymysql.Connection:
+		return pymysql.connect(host=self.host, user=self.user, password=self.password, database=self.database)
+
+	def retryable(self, err: Exception) -> bool:
+		return isinstance(err, pymysql.err.OperationalError) and err.args[0] in self.deadlock_errors
+
+
+# (pattern, replacement) pairs applied in order to turn tb_db's MySQL into SQLite
+SQLITE_RULES = [
+	(re.compile(r"%s"), "?"),
+	# SQLite takes the write lock for the whole database when a transaction begins, so row locks are redundant
+	(re.compile(r"\s+FOR\s+UPDATE\b", re.I), ""),
+	(re.compile(r"\bCONCAT\(([^,()]+),\s*([^()]+?)\)", re.I), r"CAST(\1 || \2 AS BLOB)"),
+	(re.compile(r"\bVALUES\((\w+)\)", re.I), r"excluded.\1"),
+	(re.compile(r"\bON\s+DUPLICATE\s+KEY\s+UPDATE\s+(\w+)\s*=\s*\1(?=\s*;?\s*$)", re.I), "ON CONFLICT DO NOTHING"),
+	(re.compile(r"\bON\s+DUPLICATE\s+KEY\s+UPDATE\b", re.I), "ON CONFLICT DO UPDATE SET"),
+	# MySQL's default collation compares strings case insensitively
+	(re.compile(r"\b(VARCHAR\(\d+\))", re.I), r"\1 COLLATE NOCASE"),
+	(re.compile(r"\b(BLOB\s+DEFAULT\s+)''", re.I), r"\1X''"),
+]
+
+
+@lru_cache(maxsize=256)
+def to_sqlite(sql: str) -> str:
+	"""Translates the MySQL used in towerbot to SQLite, cached as the same statements are run over and over"""
+	for pattern, replacement in SQLITE_RULES:
+		sql = pattern.sub(replacement, sql)
+	return sql
+
+
+class SQLiteCursor:
+	def __init__(self, cursor: sqlite3.Cursor):
+		self.cursor = cursor
+
+	def execute(self, query: str, args: tuple = ()) -> int:
+		self.cursor.execute(to_sqlite(query), args or ())
+		return max(self.cursor.rowcount, 0)
+
+	def executemany(self, query: str, args: list[tuple]) -> int:
+		self.cursor.executemany(to_sqlite(query), args)
+		return max(self.cursor.rowcount, 0)
+
+	def fetchone(self) -> tuple | None:
+		return self.cursor.fetchone()
+
+	def fetchall(self) -> tuple[tuple]:
+		return tuple(self.cursor.fetchall())
+
+	def close(self):
+		self.cursor.close()
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *exc):
+		self.close()
+
+
+class SQLiteConnection:
+	"""sqlite3 connection with the parts of pymysql's interface tb_db and its pool use"""
+	def __init__(self, conn: sqlite3.Connection):
+		self.conn = conn
+
+	@property
+	def server_status(self) -> int:
+		return SERVER_STATUS_IN_TRANS if self.conn.in_transaction else 0
+
+	def cursor(self) -> SQLiteCursor:
+		return SQLiteCursor(self.conn.cursor())
+
+	def begin(self):
+		# Takes the write lock up front, standing in for SELECT ... FOR UPDATE
+		self.conn.execute("BEGIN IMMEDIATE")
+
+	def commit(self):
+		self.conn.commit()
+
+	def rollback(self):
+		self.conn.rollback()
+
+	def ping(self, reconnect: bool = False):
+		self.conn.execute("SELECT 1")
+
+	def close(self):
+		self.conn.close()
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *exc):
+		self.close()
+
+
+class SQLiteBackend(Backend):
+	"""Embedded database in one file, in WAL mode so readers never wait on the writer"""
+	name = "sqlite"
+
+	def __init__(self, path: Path, busy_timeout: float = 5):
+		self.path = path
+		self.busy_timeout = busy_timeout
+
+	def connect(self) -> SQLiteConnection:
+		conn = sqlite3.connect(self.path, timeout=self.busy_timeout, check_same_thread=False)
+		conn.execute("PRAGMA journal_mode=WAL")
+		conn.execute("PRAGMA synchronous=NORMAL")  # Safe with WAL, only the last commits can be lost on power loss
+		return SQLiteConnection(conn)
+
+	def retryable(self, err: Exception) -> bool:
+		return isinstance(err, sqlite3.OperationalError) and "locked" in str(err)
+
+
+def make_backend(configs) -> Backend:
+	if configs.db_backend == "sqlite":
+		return SQLiteBackend(configs.sqlite_path)
+	return MySQLBackend(**configs.DBINFO)
+
+
+# Runs towerbot's statements against a throwaway SQLite database through tb_db's pool and prints per query latency
+if __name__ == "__main__":
+	from db_pool import ConnectionPool
+	from statistics import quantiles
+	from tempfile import TemporaryDirectory
+	from time import perf_counter
+
+	with TemporaryDirectory() as tmp:
+		backend = SQLiteBackend(Path(tmp) / "bench.db")
+		pool = ConnectionPool(backend.connect, 4)
+
+		def run(sql: str, args: tuple = (), fetch: bool = False):
+			with pool.connection() as conn:
+				with conn.cursor() as cursor:
+					rows = cursor.execute(sql, args)
+					result = cursor.fetchall() if fetch else rows
+				conn.commit()
+			return result
+
+		def request_lesson(uid: int, request: int):
+			with pool.connection() as conn:
+				conn.begin()
+				with conn.cursor() as cursor:
+					cursor.execute("SELECT requests FROM students WHERE uid = %s FOR UPDATE", (uid,))
+					cursor.fetchone()
+					cursor.execute("UPDATE students SET requests = CONCAT(requests, %s) WHERE uid = %s",
+								   (request.to_bytes(1, "big"), uid))
+				conn.commit()
+
+		for table, columns in (("user_comms", "username VARCHAR(25) PRIMARY KEY, comms TINYINT(1) NOT NULL"),
+							   ("persistent_messages", "message_id BIGINT UNSIGNED PRIMARY KEY, channel_id BIGINT "
+													   "UNSIGNED NOT NULL, type TINYINT NOT NULL, data TEXT"),
+							   ("students", "uid BIGINT UNSIGNED PRIMARY KEY, requests BLOB DEFAULT ''"),
+							   ("server_data", "id TINYINT UNSIGNED PRIMARY KEY, data BLOB DEFAULT ''")):
+			run(f"CREATE TABLE {table}({columns});")
+		seed = "INSERT INTO server_data VALUES (0, %s) ON DUPLICATE KEY UPDATE id = id;"
+		assert (run(seed, (bytes(512),)), run(seed, (bytes(512),))) == (1, 0)
+		register = "INSERT INTO students(uid) VALUES (%s) ON DUPLICATE KEY UPDATE uid = uid"
+		assert (run(register, (1,)), run(register, (1,))) == (1, 0), "register must report new students only"
+		request_lesson(1, 5)
+		request_lesson(1, 130)
+		assert run("SELECT requests FROM students WHERE uid = %s", (1,), True) == ((bytes([5, 130]),),)
+		upsert = "INSERT INTO user_comms(username, comms) VALUES (%s, %s) ON DUPLICATE KEY UPDATE comms = VALUES(comms);"
+		run(upsert, ("Pilot", 1))
+		run(upsert, ("pilot", 0))
+		assert run("SELECT username, comms FROM user_comms", (), True) == (("Pilot", 0),), "usernames are case insensitive"
+
+		i = iter(range(10 ** 6))
+		for _ in range(50):
+			run("INSERT INTO persistent_messages VALUES (%s, %s, %s, %s)", (next(i), 1, 0, "x" * 200))
+		queries = {"user_comms upsert": lambda: run(upsert, (f"pilot{next(i) % 100}", next(i) % 2)),
+				   "register student": lambda: run(register, (next(i) % 100,)),
+				   "request lesson (transaction)": lambda: request_lesson(1, next(i) % 256),
+				   "select persistent_messages": lambda: run("SELECT * FROM persistent_messages", (), True),
+				   "flush lesson counts": lambda: run("UPDATE server_data SET data = %s WHERE id = 0", (bytes(512),))}
+		for name, query in queries.items():
+			times = []
+			for _ in range(2000):
+				start = perf_counter()
+				query()
+				times.append(perf_counter() - start)
+			percentiles = quantiles(times, n=100)
+			print(f"{name:<30} p50: {percentiles[49] * 1e6:6.0f}us  p99: {percentiles[98] * 1e6:6.0f}us")
+		print(pool.stats())
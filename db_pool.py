@@ -0,0 +1,215 @@
+"""Bounded, thread safe pool of database connections"""
+from collections import deque
+from contextlib import contextmanager
+from pymysql.constants.SERVER_STATUS import SERVER_STATUS_IN_TRANS
+from threading import Condition
+from time import monotonic
+from typing import Callable, Iterator
+import logging
+
+__all__ = ["ConnectionPool"]
+
+
+class ConnectionPool:
+	"""
+	Reuses up to max_size connections made by connect. Connections idle for over ping_after seconds are pinged before
+	being handed out and replaced if dead, and ones idle for over max_idle seconds are closed instead of reused.
+	"""
+	def __init__(self, connect: Callable, max_size: int, *, max_idle: float = 300, ping_after: float = 5,
+				 wait_timeout: float = 30):
+		self.connect = connect
+		self.max_size = max_size
+		self.max_idle = max_idle
+		self.ping_after = ping_after
+		self.wait_timeout = wait_timeout
+		self.cond = Condition()
+		self.idle: deque[tuple[object, float]] = deque()   # (connection, returned at), most recently returned last
+		self.size = 0   # Connections open or being opened, idle or checked out
+		self.checkouts = 0
+		self.waits = 0          # Checkouts that had to wait for a connection to be returned
+		self.creations = 0
+		self.discards = 0       # Connections closed for being idle, dead or broken
+
+	def resize(self, max_size: int):
+		"""Changes max_size, closing idle connections over the new size"""
+		with self.cond:
+			self.max_size = max_size
+			while self.idle and self.size > max_size:
+				self._close(self.idle.popleft()[0])
+			self.cond.notify_all()
+
+	@contextmanager
+	def connection(self) -> Iterator:
+		"""Checks out a connection for the duration of the block, uncommitted work is rolled back on return"""
+		conn = self._checkout()
+		try:
+			yield conn
+		except BaseException:
+			self._checkin(conn, broken=True)
+			raise
+		self._checkin(conn)
+
+	def _checkout(self):
+		"""
+		Raises:
+			TimeoutError | No connection was returned within wait_timeout while the pool was full
+		"""
+		deadline = monotonic() + self.wait_timeout
+		with self.cond:
+			self.checkouts += 1
+			waited = False
+			while True:
+				conn = None
+				while self.idle:
+					conn, returned_at = self.idle.pop()
+					if (idle_for := monotonic() - returned_at) <= self.max_idle:
+						break
+					self._close(conn)
+					conn = None
+				if conn is not None:
+					break
+				if self.size < self.max_size:
+					self.size += 1  # Reserved here, opened below
+					break
+				if not waited:
+					self.waits += 1
+					waited = True
+				if not self.cond.wait(deadline - monotonic()):
+					raise TimeoutError(f"No database connection available within {self.wait_timeout} seconds")
+
+		# Network round trips happen outside the lock so other threads can check out meanwhile
+		if conn is not None and idle_for > self.ping_after:
+			try:
+				conn.ping(reconnect=False)
+			except Exception as err:
+				logging.warning("Replacing dead pooled database connection | %s", err)
+				with self.cond:
+					self._close(conn)
+					self.size += 1
+				conn = None
+		if conn is None:
+			try:
+				conn = self.connect()
+			except BaseException:
+				with self.cond:
+					self.size -= 1
+					self.cond.notify()
+				raise
+			with self.cond:
+				self.creations += 1
+		return conn
+
+	def _checkin(self, conn, broken: bool = False):
+		if not broken and conn.server_status & SERVER_STATUS_IN_TRANS:
+			try:
+				conn.rollback()
+			except Exception:
+				broken = True
+		elif broken:
+			# The connection may be mid result set or in a failed transaction, only keep it if it can be reset
+			try:
+				conn.rollback()
+				broken = False
+			except Exception:
+				pass
+		with self.cond:
+			if broken or self.size > self.max_size:
+				self._close(conn)
+			else:
+				self.idle.append((conn, monotonic()))
+			self.cond.notify()
+
+	def _close(self, conn):
+		"""Closes a connection the pool is giving up, called with cond held"""
+		self.size -= 1
+		self.discards += 1
+		try:
+			conn.close()
+		except Exception:
+			pass
+
+	def stats(self) -> dict[str, int]:
+		with self.cond:
+			return {"size": self.size, "idle": len(self.idle), "checkouts": self.checkouts, "waits": self.waits,
+					"creations": self.creations, "discards": self.discards}
+
+
+# Compares ops/sec with and without pooling. Uses a stand-in connection with typical LAN handshake and query latencies
+# unless --mysql is given, in which case it runs SELECT 1 against the database in configs.
+if __name__ == "__main__":
+	from concurrent.futures import ThreadPoolExecutor
+	from sys import argv
+	from time import perf_counter, sleep
+
+	if "--mysql" in argv:
+		from configs import configs
+		import pymysql
+
+		def connect():
+			return pymysql.connect(host=configs.DBINFO["host"], user=configs.DBINFO["user"],
+								   password=configs.DBINFO["password"], database=configs.DBINFO["database"])
+	else:
+		class StandInConnection:
+			"""Sleeps for the round trips a pymysql connection would make"""
+			server_status = 0
+
+			def __init__(self):
+				sleep(0.004)    # TCP handshake, server greeting, auth and database select
+
+			def ping(self, reconnect: bool = True):
+				sleep(0.0002)
+
+			def cursor(self):
+				return self
+
+			def execute(self, sql, args=None):
+				sleep(0.0003)
+
+			def fetchone(self):
+				return (1,)
+
+			def commit(self):
+				sleep(0.0002)
+
+			def rollback(self):
+				sleep(0.0002)
+
+			def close(self):
+				pass
+
+			def __enter__(self):
+				return self
+
+			def __exit__(self, *exc):
+				self.close()
+
+		connect = StandInConnection
+
+	def op(conn):
+		with conn.cursor() as cursor:
+			cursor.execute("SELECT 1")
+			cursor.fetchone()
+		conn.commit()
+
+	def unpooled():
+		with connect() as conn:
+			op(conn)
+
+	pool = ConnectionPool(connect, 4)
+
+	def pooled():
+		with pool.connection() as conn:
+			op(conn)
+
+	for threads in (1, 8):
+		results = []
+		for name, func in (("unpooled", unpooled), ("pooled", pooled)):
+			runs = 400
+			with ThreadPoolExecutor(threads) as executor:
+				start = perf_counter()
+				for _ in executor.map(lambda _: func(), range(runs)):
+					pass
+				results.append(runs / (perf_counter() - start))
+		print(f"{threads} thread(s) | unpooled: {results[0]:.0f} ops/s, pooled: {results[1]:.0f} ops/s, "
+			  f"{results[1] / results[0]:.1f}x")
+	print(pool.stats())
@@ -0,0 +1,158 @@
+"""Per statement database latency histograms for tb_db, keyed by normalized SQL and what the query was run for"""
+from contextvars import ContextVar
+from functools import lru_cache
+from threading import Lock
+from time import perf_counter
+import logging
+import re
+
+__all__ = ["InstrumentedCursor", "LatencyHistogram", "normalize", "query_origin", "QueryStats"]
+
+# What queries are being run for, ex. "/request_training" or "poller:gaw". Set by the command tree's interaction_check
+# and the poller, and carried onto tb_db's executor threads by the context async_call copies
+query_origin: ContextVar[str] = ContextVar("query_origin", default="background")
+
+BUCKETS = 20            # Bucket i holds latencies under BUCKET_BASE * 2 ** i, the last one everything slower
+BUCKET_BASE = 0.0001    # 0.1ms, so the last bucket starts at ~26s
+
+NORMALIZE_RULES = [
+	(re.compile(r"'(?:[^'\\]|\\.)*'"), "?"),
+	(re.compile(r"\b\d+\b"), "?"),
+	(re.compile(r"%s"), "?"),
+	(re.compile(r"\(\?(?:,\s*\?)+\)"), "(?, ...)"),
+	(re.compile(r"\s+"), " "),
+]
+
+
+@lru_cache(maxsize=256)
+def normalize(sql: str) -> str:
+	"""Replaces literals and placeholders with ? so statements differing only in their values share stats"""
+	for pattern, replacement in NORMALIZE_RULES:
+		sql = pattern.sub(replacement, sql)
+	return sql.strip().rstrip(";")
+
+
+class LatencyHistogram:
+	"""Counts of latencies in doubling buckets, so percentiles are estimated to within a factor of two"""
+	def __init__(self):
+		self.buckets = [0] * BUCKETS
+		self.count = 0
+		self.total = 0.
+		self.max = 0.
+		self.rows = 0   # Rows returned to the caller
+
+	def add(self, seconds: float):
+		self.buckets[min(BUCKETS - 1, int(seconds / BUCKET_BASE).bit_length())] += 1
+		self.count += 1
+		self.total += seconds
+		self.max = max(self.max, seconds)
+
+	def merge(self, other: "LatencyHistogram"):
+		self.buckets = [mine + theirs for mine, theirs in zip(self.buckets, other.buckets)]
+		self.count += other.count
+		self.total += other.total
+		self.max = max(self.max, other.max)
+		self.rows += other.rows
+
+	def percentile(self, q: float) -> float:
+		"""Upper bound of the bucket holding the q-th quantile, capped at the slowest latency seen"""
+		seen = 0
+		for i, count in enumerate(self.buckets):
+			seen += count
+			if seen >= q * self.count:
+				return min(BUCKET_BASE * 2 ** i, self.max)
+		return self.max
+
+
+class QueryStats:
+	"""Latency histograms by (normalized SQL, origin) and for opening connections, logging statements over slow_threshold"""
+	def __init__(self, slow_threshold: float):
+		self.slow_threshold = slow_threshold    # Seconds
+		self.lock = Lock()
+		self.queries: dict[tuple[str, str], LatencyHistogram] = {}
+		self.connects = LatencyHistogram()
+		self.started_at = perf_counter()
+
+	def record(self, sql: str, seconds: float) -> LatencyHistogram:
+		"""Records one execution of sql, returning its histogram so the rows it returns can be added"""
+		origin = query_origin.get()
+		key = (normalize(sql), origin)
+		with self.lock:
+			if (histogram := self.queries.get(key)) is None:
+				histogram = self.queries[key] = LatencyHistogram()
+			histogram.add(seconds)
+		if seconds >= self.slow_threshold:
+			logging.warning("Slow query from %s took %.0fms | %s", origin, seconds * 1000, key[0])
+		return histogram
+
+	def record_connect(self, seconds: float):
+		with self.lock:
+			self.connects.add(seconds)
+
+	def by_origin(self) -> dict[str, LatencyHistogram]:
+		"""Histograms of every statement run for each origin merged together"""
+		origins = {}
+		with self.lock:
+			for (_, origin), histogram in self.queries.items():
+				origins.setdefault(origin, LatencyHistogram()).merge(histogram)
+		return origins
+
+	def summary(self, limit: int = 10) -> str:
+		"""Plain text report of the origins and the limit statements with the most total time"""
+		def line(name: str, histogram: LatencyHistogram) -> str:
+			return (f"{name} | {histogram.count}x, total {histogram.total:.2f}s, p50 {histogram.percentile(0.5) * 1000:.1f}ms, "
+					f"p99 {histogram.percentile(0.99) * 1000:.1f}ms, max {histogram.max * 1000:.1f}ms, {histogram.rows} rows")
+
+		origins = sorted(self.by_origin().items(), key=lambda item: item[1].total, reverse=True)
+		with self.lock:
+			statements = sorted(self.queries.items(), key=lambda item: item[1].total, reverse=True)[:limit]
+			connects = line("connect", self.connects)
+		return "\n".join([f"Over {(perf_counter() - self.started_at) / 3600:.1f}h, {connects}", "", "By origin:"] +
+						 [line(origin, histogram) for origin, histogram in origins] + ["", "Slowest statements:"] +
+						 [line(f"{origin} {sql[:80]}", histogram) for (sql, origin), histogram in statements])
+
+
+class InstrumentedCursor:
+	"""Wraps a database cursor to time every statement and count the rows fetched from it into stats"""
+	def __init__(self, cursor, stats: QueryStats):
+		self.cursor = cursor
+		self.stats = stats
+		self.last: LatencyHistogram | None = None   # Histogram of the statement rows are being fetched from
+
+	def execute(self, query: str, args=None) -> int:
+		start = perf_counter()
+		try:
+			return self.cursor.execute(query, args)
+		finally:
+			self.last = self.stats.record(query, perf_counter() - start)
+
+	def executemany(self, query: str, args: list[tuple]) -> int:
+		start = perf_counter()
+		try:
+			return self.cursor.executemany(query, args)
+		finally:
+			self.last = self.stats.record(query, perf_counter() - start)
+
+	def _fetched(self, rows: int):
+		if self.last is not None:
+			with self.stats.lock:
+				self.last.rows += rows
+
+	def fetchone(self):
+		row = self.cursor.fetchone()
+		self._fetched(row is not None)
+		return row
+
+	def fetchall(self):
+		rows = self.cursor.fetchall()
+		self._fetched(len(rows))
+		return rows
+
+	def __getattr__(self, name: str):
+		return getattr(self.cursor, name)
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *exc):
+		self.cursor.close()
@@ -0,0 +1,131 @@
+"""In memory lesson request counters, written behind to the server_data table"""
+from discord.ext import tasks
+from tb_db import async_call, sql_op, sql_transaction
+from threading import RLock
+import logging
+
+__all__ = ["lesson_counts", "LessonCounter", "Ranking"]
+
+LESSON_SLOTS = 256  # Indexed by request byte, msb is the branch, see lesson_tracking.request_training
+BRANCH_SLOTS = 128
+
+
+def decode_counts(data: bytes) -> list[int]:
+	"""Request counts are stored as two byte big-endian unsigned integers indexed by request byte"""
+	return [int.from_bytes(data[i:i + 2], "big", signed=False) for i in range(0, len(data), 2)]
+
+
+def encode_counts(counts: list[int]) -> bytes:
+	return b"".join(count.to_bytes(2, "big", signed=False) for count in counts)
+
+
+class Ranking:
+	"""
+	Keys ordered by count, highest first. Counts only ever go up by one, so an increment just swaps the key with the
+	first key sharing its count, keeping the order sorted in O(1) and making the top k a slice.
+	"""
+	def __init__(self, counts: dict[int, int]):
+		self.counts = dict(counts)
+		self.order = sorted(self.counts, key=lambda key: (-self.counts[key], key))
+		self.position = {key: i for i, key in enumerate(self.order)}
+		self.block_start: dict[int, int] = {}     # Count: index of the first key with it
+		for i, key in enumerate(self.order):
+			self.block_start.setdefault(self.counts[key], i)
+
+	def increment(self, key: int):
+		count = self.counts[key]
+		i, first = self.position[key], self.block_start[count]
+		other = self.order[first]
+		self.order[i], self.order[first] = other, key
+		self.position[other], self.position[key] = i, first
+
+		if first + 1 < len(self.order) and self.counts[self.order[first + 1]] == count:
+			self.block_start[count] = first + 1
+		else:
+			del self.block_start[count]
+		self.counts[key] = count + 1
+		# Joins the end of the block above if there is one, otherwise starts a new one
+		self.block_start.setdefault(count + 1, first)
+
+	def top(self, k: int) -> list[tuple[int, int]]:
+		"""Up to k (key, count) pairs with the highest counts, only including keys that have been counted"""
+		return [(key, self.counts[key]) for key in self.order[:k] if self.counts[key]]
+
+
+class LessonCounter:
+	"""
+	Request counts for every lesson, loaded once and incremented in memory. Increments since the last flush are kept
+	as deltas and added to the stored counts in one locked read-modify-write every flush, so writes from anywhere
+	else are never overwritten.
+	"""
+	def __init__(self):
+		self.counts = [0] * LESSON_SLOTS
+		self.pending = [0] * LESSON_SLOTS  # Increments not yet written to the database
+		self.lock = RLock()     # Reentrant so a flush from the interrupt handler can't deadlock the main thread
+		self.rankings: dict[int | None, Ranking] = {}
+		self._rank()
+
+	def _rank(self):
+		"""Rebuilds the rankings, overall under None and per branch under 0 (ATSA) and 1 (TCA)"""
+		self.rankings = {None: Ranking(dict(enumerate(self.counts)))}
+		for branch in (0, 1):
+			requests = range(branch * BRANCH_SLOTS, (branch + 1) * BRANCH_SLOTS)
+			self.rankings[branch] = Ranking({request: self.counts[request] for request in requests})
+
+	def load(self):
+		data = sql_op("SELECT data FROM server_data WHERE id = 0", ())[0]
+		with self.lock:
+			self.counts = [count + pending for count, pending in zip(decode_counts(data), self.pending)]
+			self._rank()
+
+	async def start(self):
+		await async_call(self.load)
+		self.flush_loop.start()
+
+	def increment(self, request: int):
+		with self.lock:
+			self.counts[request] += 1
+			self.pending[request] += 1
+			self.rankings[None].increment(request)
+			self.rankings[request // BRANCH_SLOTS].increment(request)
+
+	def top(self, k: int, branch: int | None = None) -> list[tuple[int, int]]:
+		"""Up to k (request byte, count) pairs for the most requested lessons, in branch if given"""
+		with self.lock:
+			return self.rankings[branch].top(k)
+
+	def snapshot(self) -> list[int]:
+		with self.lock:
+			return self.counts.copy()
+
+	def flush(self):
+		"""Writes pending increments, which are kept for the next flush if the write fails"""
+		with self.lock:
+			if not any(self.pending):
+				return
+			deltas = self.pending
+			self.pending = [0] * LESSON_SLOTS
+		try:
+			self._write(deltas)
+		except Exception:
+			with self.lock:
+				self.pending = [pending + delta for pending, delta in zip(self.pending, deltas)]
+			raise
+
+	@staticmethod
+	@sql_transaction
+	def _write(cursor, deltas: list[int]):
+		cursor.execute("SELECT data FROM server_data WHERE id = 0 FOR UPDATE")
+		stored = decode_counts(cursor.fetchone()[0])
+		cursor.execute("UPDATE server_data SET data = %s WHERE id = 0",
+					   (encode_counts([min(count + delta, 0xffff) for count, delta in zip(stored, deltas)]),))
+
+	@tasks.loop(seconds=60)
+	async def flush_loop(self):
+		try:
+			await async_call(self.flush)
+		except Exception as err:
+			logging.error("Failed to flush lesson request counts | %s", err)
+
+
+lesson_counts = LessonCounter()
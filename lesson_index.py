@@ -0,0 +1,67 @@
+"""Inverted index from lessons to the students who requested, attended or completed them"""
+from collections import defaultdict
+from discord.ext import tasks
+from tb_db import async_call, sql_op
+from threading import Lock
+import logging
+
+__all__ = ["lesson_index"]
+
+COLUMNS = ("requests", "attended_sessions", "completed_sessions")  # Blobs of request bytes in the students table
+
+
+class LessonIndex:
+	"""
+	Uids by lesson request byte for each of COLUMNS, built from one scan of the students table. Kept in sync by the
+	commands that write those columns, and rebuilt every reload interval to pick up changes made anywhere else.
+	"""
+	def __init__(self):
+		self.index: dict[str, dict[int, set[int]]] = {column: defaultdict(set) for column in COLUMNS}
+		self.lock = Lock()
+		self.added_while_loading: list[tuple[str, int, int]] | None = None
+
+	def load(self):
+		with self.lock:
+			self.added_while_loading = []
+		rows = sql_op(f"SELECT uid, {', '.join(COLUMNS)} FROM students", (), fetch_all=True)
+		index = {column: defaultdict(set) for column in COLUMNS}
+		for uid, *blobs in rows:
+			for column, blob in zip(COLUMNS, blobs):
+				for request in blob or b"":
+					index[column][request].add(uid)
+		with self.lock:
+			# Adds that raced the scan may be missing from it, reapplying ones that weren't is harmless
+			for column, uid, request in self.added_while_loading:
+				index[column][request].add(uid)
+			self.index = index
+			self.added_while_loading = None
+
+	async def start(self):
+		await async_call(self.load)
+		self.reload.start()
+
+	def add(self, column: str, uid: int, request: int):
+		"""Records a request byte being appended to a student's column"""
+		with self.lock:
+			self.index[column][request].add(uid)
+			if self.added_while_loading is not None:
+				self.added_while_loading.append((column, uid, request))
+
+	def candidates(self, request: int) -> list[tuple[int, bool]]:
+		"""(uid, attended) for every student who requested the lesson and hasn't completed it, attended first"""
+		with self.lock:
+			pending = self.index["requests"].get(request, set()) - self.index["completed_sessions"].get(request, set())
+			attended = self.index["attended_sessions"].get(request, set())
+			return sorted(((uid, uid in attended) for uid in pending), key=lambda candidate: (not candidate[1], candidate[0]))
+
+	@tasks.loop(minutes=30)
+	async def reload(self):
+		if self.reload.current_loop == 0:
+			return  # Just loaded by start
+		try:
+			await async_call(self.load)
+		except Exception as err:
+			logging.error("Failed to reload lesson index | %s", err)
+
+
+lesson_index = LessonIndex()
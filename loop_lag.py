@@ -0,0 +1,28 @@
+"""Measures how long the event loop is blocked for, used by the benchmarks in __main__ blocks"""
+from asyncio import create_task, sleep
+from time import perf_counter
+from typing import Awaitable, Callable
+
+__all__ = ["max_lag_during"]
+
+
+async def max_lag_during(start: Callable[[], Awaitable], interval: float = 0.01) -> float:
+	"""
+	Awaits start() while a ticker sleeps interval seconds at a time, returning the most a tick overran by, which is the
+	longest the event loop was blocked for. Takes a callable so nothing is scheduled before the ticker is running.
+	"""
+	max_lag = 0.
+
+	async def ticker():
+		nonlocal max_lag
+		while True:
+			before = perf_counter()
+			await sleep(interval)
+			max_lag = max(max_lag, perf_counter() - before - interval)
+
+	task = create_task(ticker())
+	await sleep(interval * 2)
+	await start()
+	await sleep(interval * 2)   # Lets the ticker wake from a block that lasted until start() returned
+	task.cancel()
+	return max_lag
@@ -3,6 +3,7 @@ logging.basicConfig(filename='runtime.log', encoding='utf-8', level=logging.INFO
 
 from configs import configs
 from datetime import datetime
+from lesson_counter import lesson_counts
 from signal import signal, SIGINT
 from tb_discord import bot
 from tb_multiprocessing import stop_list
@@ -11,7 +12,11 @@ from tb_multiprocessing import stop_list
 # =======INTERRUPT HANDLING=======
 
 def clean_close(signum, frame):
-	"""Prevents leaving hanging TCP sockets on localhost"""
+	"""Prevents leaving hanging TCP sockets on localhost and saves lesson request counts not yet written"""
+	try:
+		lesson_counts.flush()
+	except Exception as err:
+		logging.error("Failed to flush lesson request counts on close | %s", err)
 	for func in stop_list:
 		func()
 	exit()
@@ -1,35 +1,183 @@
 """Interface between server_data process and main process"""
+from asyncio import Event, Future, get_running_loop, Task, wait_for
+from configs import configs
+from itertools import count
 from sys import modules
-from tb_multiprocessing.server_data import conn
-from tb_multiprocessing.io_utils import network_decode, SocketHandler
+from time import time
+from tb_multiprocessing.server_data import snapshot_path, supervisor
+from tb_multiprocessing.io_utils import ACK_FRAME, FrameProtocol, HEARTBEAT_FRAME, load_snapshot, network_decode, \
+    network_encode, RESTORED_KEY, RPC_FRAME, RPCError, Snapshot, SNAPSHOT_FRAME
+from socket import socket
 from types import ModuleType
+from typing import Awaitable, Callable
+import logging
 
 
 class ServerGetter(ModuleType):
     def __init__(self):
         super().__init__(__name__, "Interface between server_data process and main process")
-        self.connection = SocketHandler(conn)
+        self.protocol = None
+        self.started_at: float | None = None
+        self.ready_after: float | None = None   # Seconds from start to the first connection being attached
+        self._start_task: Task | None = None
+        self.connected = Event()    # Set while a connection to the server_data process is attached
+        self.snapshot = self._restore()
+        self.listeners: list[Callable[[Snapshot], Awaitable]] = []
+        self._listener_tasks: set[Task] = set()
+        self._pending: dict[int, Future] = {}
+        self._request_ids = count()
+
+    @staticmethod
+    def _restore() -> Snapshot:
+        """Last saved data from the server_data process as version 0, marked as restored, so it can be shown at once"""
+        saved = load_snapshot(snapshot_path) or {RESTORED_KEY: {}}
+        data = {source.id: saved.get(source.id, {"exception": "Update has not yet run"}) for source in configs.servers}
+        data[RESTORED_KEY] = {server: saved_at for server, saved_at in saved[RESTORED_KEY].items() if server in data}
+        if data[RESTORED_KEY]:
+            logging.info("Restored saved data for %s server(s)", len(data[RESTORED_KEY]))
+        return Snapshot(network_encode(data), 0, time())
+
+    def start(self):
+        """
+        Spawns the server_data process and starts receiving its frames in the background on the running event loop,
+        returning straight away so the bot can log in while the process starts up
+        """
+        if self.started_at is None:
+            self.started_at = time()
+            self._start_task = get_running_loop().create_task(supervisor.start(self._attach))
+
+    async def _attach(self, conn: socket):
+        """Switches to a new connection, called by the supervisor on start and whenever the process is restarted"""
+        if self.protocol is not None:
+            # Detached first so the old connection closing late can't mark the new one as lost
+            self.protocol.on_lost = None
+            self.protocol.transport.close()
+            self._lost(None)
+        _, self.protocol = await get_running_loop().connect_accepted_socket(
+            lambda: FrameProtocol(self._receive, self._lost), sock=conn)
+        if self.ready_after is None:
+            self.ready_after = time() - self.started_at
+            logging.info("server_data process ready %.2f seconds after start", self.ready_after)
+        self.connected.set()
+
+    def _lost(self, exc: Exception | None):
+        """Fails calls still waiting on the lost connection instead of letting them time out"""
+        self.connected.clear()
+        for future in self._pending.values():
+            if not future.done():
+                future.set_exception(ConnectionError("Connection to server_data process lost"))
+        self._pending.clear()
+
+    def _receive(self, kind: int, body: memoryview):
+        """Called by the protocol for every complete frame"""
+        supervisor.beat()
+        if kind == HEARTBEAT_FRAME:
+            return
+        elif kind == SNAPSHOT_FRAME:
+            self._publish(body)
+        elif kind == ACK_FRAME:
+            request_id, succeeded, result = network_decode(body)
+            if (future := self._pending.pop(request_id, None)) and not future.done():
+                future.set_result((succeeded, result))
+        else:
+            logging.error("Discarding server_data frame of unknown type %s", kind)
+
+    async def call(self, method: str, *args, timeout: float = 10):
+        """
+        Runs method in the server_data process and returns its result
+        Raises:
+            ConnectionError | start hasn't been called yet
+            TimeoutError | Not connected or no acknowledgement within timeout seconds
+            RPCError | method raised an exception in the server_data process
+        """
+        if self.started_at is None:
+            raise ConnectionError("server_data process has not been started")
+        # Still starting up or being restarted
+        await wait_for(self.connected.wait(), timeout)
+
+        request_id = next(self._request_ids)
+        future = get_running_loop().create_future()
+        self._pending[request_id] = future
+        try:
+            self.protocol.write(network_encode((request_id, method, args)), RPC_FRAME)
+            succeeded, result = await wait_for(future, timeout)
+        finally:
+            self._pending.pop(request_id, None)
+
+        if not succeeded:
+            raise RPCError(result)
+        return result
+
+    async def log_user(self, username: str, state: bool):
+        """Logs a user as opted in (True) or out (False), reflected in the next snapshot"""
+        await self.call("log_user", username, state)
+
+    async def history(self, server: str, start: float, end: float, points: int) -> list[tuple[float, int, int]]:
+        """(time, players, opted in) samples for server between start and end, downsampled to at most points"""
+        return await self.call("history", server, start, end, points)
+
+    async def whereis(self, query: str, limit: int) -> list[tuple[str, str, float, float, bool]]:
+        """(username, server, first seen, last seen, online) for an exact username, or up to limit prefix matches"""
+        return await self.call("whereis", query, limit)
+
+    def _publish(self, body: memoryview):
+        """Replaces the current snapshot with one from a new frame and notifies listeners"""
+        try:
+            self.snapshot = Snapshot(body, self.snapshot.version + 1, time())
+        except ValueError as err:
+            logging.error("Discarding malformed server_data frame | %s", err)
+            return
+
+        loop = get_running_loop()
+        for listener in self.listeners:
+            task = loop.create_task(listener(self.snapshot))
+            self._listener_tasks.add(task)
+            task.add_done_callback(self._listener_tasks.discard)
+
+    def add_listener(self, listener: Callable[[Snapshot], Awaitable]):
+        """Registers a coroutine function to be called with every new snapshot as soon as its frame arrives"""
+        self.listeners.append(listener)
+
+    def remove_listener(self, listener: Callable[[Snapshot], Awaitable]):
+        if listener in self.listeners:
+            self.listeners.remove(listener)
 
     @property
-    def gaw(self):
-        data = network_decode(self.connection.read())
-        return data[0]
+    def ipc_stale(self) -> bool:
+        """Whether the server_data process has stopped sending heartbeats, so the snapshot may be out of date"""
+        return supervisor.stalled
 
     @property
-    def pgaw(self):
-        data = network_decode(self.connection.read())
-        return data[1]
+    def ipc_silent_for(self) -> float:
+        """Seconds since anything was last received from the server_data process"""
+        return supervisor.silent_for
+
+    def restored_at(self, server: str) -> float | None:
+        """When the shown data for server was saved, if it is restored and hasn't been polled since the last restart"""
+        if RESTORED_KEY not in self.snapshot:
+            return None
+        return self.snapshot[RESTORED_KEY].get(server)
 
     @property
-    def lkeu(self):
-        data = network_decode(self.connection.read())
-        return data[2]
+    def version(self) -> int:
+        return self.snapshot.version
 
     @property
-    def lkna(self):
-        data = network_decode(self.connection.read())
-        return data[3]
+    def received_at(self) -> float:
+        return self.snapshot.received_at
 
+    def changed_since(self, version: int) -> bool:
+        """Whether a frame newer than version has been received, without decoding it"""
+        return self.snapshot.changed_since(version)
 
-modules[__name__] = ServerGetter()
+    def __getattr__(self, name: str):
+        """Server data by source id from the current snapshot, ex. server_data.gaw"""
+        if name.startswith("_") or name in {"snapshot", "listeners", "protocol"}:
+            raise AttributeError(name)
+        try:
+            return self.snapshot[name]
+        except KeyError:
+            raise AttributeError(f"No server with id {name}") from None
 
+
+modules[__name__] = ServerGetter()
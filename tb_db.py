@@ -1,20 +1,45 @@
+from asyncio import get_running_loop
+from concurrent.futures import ThreadPoolExecutor
 from configs import configs
+from contextlib import contextmanager
+from contextvars import copy_context
+from db_backends import make_backend
+from db_pool import ConnectionPool
+from db_stats import InstrumentedCursor, QueryStats
+from functools import partial, wraps
+from random import uniform
 from sys import argv
-from typing import Callable
-import pymysql
+from time import perf_counter, sleep
+from typing import Callable, Iterator
+import logging
 
 
-def connect_to_db() -> pymysql.Connection:
-	"""Connects to database with info in configs and returns connection"""
-	return pymysql.connect(host=configs.DBINFO["host"], user=configs.DBINFO["user"],
-						   password=configs.DBINFO["password"], database=configs.DBINFO["database"])
+backend = make_backend(configs)
+query_stats = QueryStats(configs.slow_query_ms / 1000)
+
+
+def connect_to_db():
+	"""Connects to the database backend selected in configs and returns connection"""
+	start = perf_counter()
+	conn = backend.connect()
+	query_stats.record_connect(perf_counter() - start)
+	return conn
+
+
+def cursor_for(conn) -> InstrumentedCursor:
+	"""Cursor of conn whose statements are recorded in query_stats"""
+	return InstrumentedCursor(conn.cursor(), query_stats)
+
+
+# Each process gets its own pool, the server_data process resizes it to configs.poller_db_pool_size
+pool = ConnectionPool(connect_to_db, configs.db_pool_size)
 
 
 def sql_func(func: Callable) -> Callable:
 	"""Decorator for functions to be run in sql"""
 	def wrapper(*args, **kwargs):
-		with connect_to_db() as conn:
-			with conn.cursor() as cursor:
+		with pool.connection() as conn:
+			with cursor_for(conn) as cursor:
 				func(conn, cursor, *args, **kwargs)
 	return wrapper
 
@@ -34,8 +59,8 @@ def sql_op(sql_cmd: list[str] | str, args: list[tuple] | tuple,
 
 	assert (type(sql_cmd), type(args)) in {(list, list), (str, tuple)}, "sql_op arguments of wrong types"
 
-	with connect_to_db() as conn:
-		with conn.cursor() as cursor:
+	with pool.connection() as conn:
+		with cursor_for(conn) as cursor:
 			if type(sql_cmd) == list:
 				out = []
 				for cmd, arg in zip(sql_cmd, args):
@@ -54,41 +79,119 @@ def sql_op(sql_cmd: list[str] | str, args: list[tuple] | tuple,
 	return out
 
 
+def sql_many(sql_cmd: str, args: list[tuple]) -> int:
+	"""
+	Runs one SQL command for every tuple in args in a single batch, ex. bulk inserts, and returns the rows affected
+	"""
+	with pool.connection() as conn:
+		with cursor_for(conn) as cursor:
+			affected = cursor.executemany(sql_cmd, args)
+		conn.commit()
+	return affected
+
+
+@contextmanager
+def transaction() -> Iterator:
+	"""
+	Yields a cursor whose statements are committed together once the block completes, or rolled back if it raises.
+	Rows read with SELECT ... FOR UPDATE stay locked against other transactions until then.
+	"""
+	with pool.connection() as conn:
+		conn.begin()
+		with cursor_for(conn) as cursor:
+			yield cursor
+		conn.commit()
+
+
+DEADLOCK_RETRIES = 3
+
+
+def sql_transaction(func: Callable) -> Callable:
+	"""
+	Decorator for functions to be run as one transaction, passed a cursor as their first argument and returning its
+	result. The whole function is retried if the database aborts it to break a deadlock, so it must only change state
+	through the cursor.
+	"""
+	@wraps(func)
+	def wrapper(*args, **kwargs):
+		for attempt in range(DEADLOCK_RETRIES + 1):
+			try:
+				with transaction() as cursor:
+					return func(cursor, *args, **kwargs)
+			except Exception as err:
+				if not backend.retryable(err) or attempt == DEADLOCK_RETRIES:
+					raise
+				logging.warning("Retrying %s after deadlock | %s", func.__name__, err)
+				sleep(uniform(0, 0.05 * 2 ** attempt))
+	return wrapper
+
+
+# One thread per pooled connection, so queries queue here rather than holding a thread while waiting on the pool
+executor = ThreadPoolExecutor(max_workers=configs.db_pool_size, thread_name_prefix="tb_db")
+
+
+async def async_call(func: Callable, *args, **kwargs):
+	"""
+	Runs a blocking database function, ex. one decorated with sql_transaction, on tb_db's executor so the event loop
+	keeps running for its round trips
+	"""
+	context = copy_context()
+	return await get_running_loop().run_in_executor(executor, partial(context.run, func, *args, **kwargs))
+
+
+async def async_sql_op(sql_cmd: list[str] | str, args: list[tuple] | tuple,
+					   fetch_all: bool = False) -> list[tuple[tuple]] | list[tuple] | tuple[tuple] | tuple:
+	"""sql_op for coroutines, run on tb_db's executor so the event loop keeps running for the round trip"""
+	return await async_call(sql_op, sql_cmd, args, fetch_all)
+
+
+# Written for MySQL, SQLite gets them translated by its backend
+SCHEMA = {"user_comms": ("username VARCHAR(25) PRIMARY KEY,"
+						 "comms TINYINT(1) NOT NULL"),
+		  "persistent_messages": ("message_id BIGINT UNSIGNED PRIMARY KEY,"
+								  "channel_id BIGINT UNSIGNED NOT NULL,"
+								  "type TINYINT NOT NULL,"
+								  "data TEXT"),
+		  "students": ("uid BIGINT UNSIGNED PRIMARY KEY,"
+					   "requests BLOB DEFAULT '',"
+					   "attended_sessions BLOB DEFAULT '',"
+					   "completed_sessions BLOB DEFAULT ''"),
+		  "server_data": ("id TINYINT UNSIGNED PRIMARY KEY,"
+						  "data BLOB DEFAULT ''")}
+LESSON_COUNTS_ROW = ("INSERT INTO server_data VALUES (0, %s) ON DUPLICATE KEY UPDATE id = id;",
+					 (int(0).to_bytes(2, "big") * 256,))
+
+
 if "-r" in argv:
-	sql_op(["CREATE OR REPLACE TABLE user_comms("
-				"username VARCHAR(25) PRIMARY KEY,"
-				"comms TINYINT(1) NOT NULL);",
-			"CREATE OR REPLACE TABLE persistent_messages("
-				"message_id BIGINT UNSIGNED PRIMARY KEY,"
-				"channel_id BIGINT UNSIGNED NOT NULL,"
-				"type TINYINT NOT NULL,"
-				"data TEXT);",
-			"CREATE OR REPLACE TABLE students("
-				"uid BIGINT UNSIGNED PRIMARY KEY,"
-				"requests BLOB DEFAULT '',"
-				"attended_sessions BLOB DEFAULT '',"
-				"completed_sessions BLOB DEFAULT '');",
-			"CREATE OR REPLACE TABLE server_data("
-				"id TINYINT UNSIGNED PRIMARY KEY,"
-				"data BLOB DEFAULT '');",
-			"INSERT INTO server_data VALUES (0, %s);"], [(), (), (), (), (int(0).to_bytes(2, "big") * 256)])
-	print(*sql_op(["SELECT * FROM user_comms;", "SELECT * FROM persistent_messages;", "SELECT * FROM students",
-				  "SELECT * FROM server_data"], [(), (), (), ()], fetch_all=True), sep="\n")
+	sql_op([f"DROP TABLE IF EXISTS {table};" for table in SCHEMA] +
+		   [f"CREATE TABLE {table}({columns});" for table, columns in SCHEMA.items()] + [LESSON_COUNTS_ROW[0]],
+		   [()] * len(SCHEMA) * 2 + [LESSON_COUNTS_ROW[1]])
+	print(*sql_op([f"SELECT * FROM {table};" for table in SCHEMA], [()] * len(SCHEMA), fetch_all=True), sep="\n")
 else:
-	sql_op(["CREATE TABLE IF NOT EXISTS user_comms("
-				"username VARCHAR(25) PRIMARY KEY,"
-				"comms TINYINT(1) NOT NULL);",
-			"CREATE TABLE IF NOT EXISTS persistent_messages("
-				"message_id BIGINT UNSIGNED PRIMARY KEY,"
-				"channel_id BIGINT UNSIGNED NOT NULL,"
-				"type TINYINT NOT NULL,"
-				"data TEXT);",
-			"CREATE TABLE IF NOT EXISTS students("
-				"uid BIGINT UNSIGNED PRIMARY KEY,"
-				"requests BLOB DEFAULT '',"
-				"attended_sessions BLOB DEFAULT '',"
-				"completed_sessions BLOB DEFAULT '');",
-			"CREATE TABLE IF NOT EXISTS server_data("
-				"id TINYINT UNSIGNED PRIMARY KEY,"
-				"data BLOB DEFAULT '');"], [(), (), (), ()])
+	sql_op([f"CREATE TABLE IF NOT EXISTS {table}({columns});" for table, columns in SCHEMA.items()] +
+		   [LESSON_COUNTS_ROW[0]], [()] * len(SCHEMA) + [LESSON_COUNTS_ROW[1]])
+
+
+# Measures how long the event loop is blocked while a deliberately slow query runs, called synchronously and awaited
+if __name__ == "__main__":
+	from asyncio import run
+	from loop_lag import max_lag_during
+
+	# About a second on each backend, SQLite's counts up in a recursive CTE as it has no sleep function
+	SLOW_QUERIES = {"mysql": ("SELECT SLEEP(%s)", (1,)),
+					"sqlite": ("WITH RECURSIVE c(x) AS (SELECT 1 UNION ALL SELECT x + 1 FROM c WHERE x < %s) "
+							   "SELECT COUNT(*) FROM c", (5000000,))}
+
+	async def blocking():
+		sql_op(*SLOW_QUERIES[backend.name])
+
+	async def awaited():
+		await async_sql_op(*SLOW_QUERIES[backend.name])
+
+	async def main():
+		blocked, lag = await max_lag_during(blocking), await max_lag_during(awaited)
+		print(f"{backend.name} slow query | max event loop lag with sql_op: {blocked * 1000:.0f}ms, "
+			  f"with async_sql_op: {lag * 1000:.0f}ms")
+		assert lag < blocked / 10, "async_sql_op blocked the event loop"
 
+	run(main())
@@ -1,6 +1,7 @@
 """Coalesce all discord-related towerbot scripts"""
+from db_stats import query_origin
 from discord.ext.commands import Bot
-from discord import Intents
+from discord import Intents, Interaction
 
 __all__ = ["bot"]
 
@@ -12,6 +13,16 @@ intents.guild_messages = True
 bot = Bot(command_prefix="t?", intents=intents)
 
 
+async def tag_queries(interaction: Interaction) -> bool:
+	"""Attributes the database queries an app command runs to it in tb_db's query stats"""
+	if interaction.command is not None:
+		query_origin.set(f"/{interaction.command.qualified_name}")
+	return True
+
+
+bot.tree.interaction_check = tag_queries
+
+
 # Imported below top to allow for bot to init
 import tb_discord.tb_events
 from tb_discord import tb_commands
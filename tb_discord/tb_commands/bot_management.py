@@ -1,7 +1,9 @@
 """Towerbot commands dealing with bot management"""
-from discord import app_commands, Interaction
+from discord import app_commands, File, Interaction
+from io import BytesIO
 from tb_discord.tb_commands.filters import check_is_owner
 from tb_discord import bot
+from tb_db import pool, query_stats
 
 
 __all__ = ["command_list"]
@@ -11,7 +13,8 @@ __all__ = ["command_list"]
 @check_is_owner()
 async def ping(interaction: Interaction):
     latency = str(bot.latency)[:-13]
-    await interaction.response.send_message(f"Pong! Ping is {latency}s.")
+    stats = ", ".join(f"{key} {value}" for key, value in pool.stats().items())
+    await interaction.response.send_message(f"Pong! Ping is {latency}s.\nDatabase pool: {stats}")
 
 
 @app_commands.command()
@@ -21,4 +24,15 @@ async def sync_command_tree(interaction: Interaction):
     await interaction.response.send_message("Tree synced.", ephemeral=True)
 
 
-command_list = [ping, sync_command_tree]
+@app_commands.command()
+@check_is_owner()
+async def db_stats(interaction: Interaction):
+    """Database query latency by command and statement since start"""
+    summary = query_stats.summary()
+    if len(summary) <= 1990:
+        await interaction.response.send_message(f"```{summary}```", ephemeral=True)
+    else:
+        await interaction.response.send_message(file=File(BytesIO(summary.encode()), "db_stats.txt"), ephemeral=True)
+
+
+command_list = [db_stats, ping, sync_command_tree]
@@ -1,51 +1,123 @@
 """Towerbot commands dealing with info from external sources"""
-from discord import app_commands, Interaction, TextChannel
+from asyncio import to_thread
+from discord import AllowedMentions, app_commands, File, Interaction, TextChannel
 from discord.errors import NotFound
 from tb_discord.tb_commands.filters import check_is_owner
-from tb_discord.tb_ui import PlayersEmbed, ServersEmbed
+from tb_discord.tb_ui import PlayersEmbed, render_history, ServersEmbed
+from tb_multiprocessing.io_utils import RPCError
+from tb_discord.tb_ui.server_embeds import server_dict
+from time import time
 from urllib.request import urlopen
+import logging
 import server_data
 
 
 __all__ = ["command_list"]
 
 
+async def server_autocomplete(interaction: Interaction, current: str) -> list[app_commands.Choice[str]]:
+    """Servers from the configured registry matching what has been typed so far"""
+    current = current.lower()
+    return [app_commands.Choice(name=name, value=server) for server, name in server_dict.items()
+            if current in name.lower() or current in server][:25]
+
+
 @app_commands.command()
 @app_commands.describe(name="DCS server selection")
-@app_commands.choices(name=[
-    app_commands.Choice(name="Hoggit - Georgia At War", value="gaw"),
-    app_commands.Choice(name="Hoggit - Persian Gulf At War", value="pgaw"),
-    app_commands.Choice(name="Lima Kilo - Flashpoint Levant - EU", value="lkeu"),
-    app_commands.Choice(name="Lima Kilo - Flashpoint Levant - NA", value="lkna")
-])
-async def info(interaction: Interaction, name: app_commands.Choice[str], details: str = "all"):
+@app_commands.autocomplete(name=server_autocomplete)
+async def info(interaction: Interaction, name: str, details: str = "all"):
     """
     Gets player count info for designated servers
     Args:
-        name | Choice[str] | Name of server
+        name | str | Id of server
         details | str | Wanted statistics, defaults to all
     """
-    server = name.value  # take the actual string value from the input Choice
     details = details.lower()
 
+    if name not in server_dict:
+        await interaction.response.send_message("That server isn't tracked by Towerbot.", ephemeral=True)
+        return
+
     await interaction.response.send_message("Getting server data...")
 
-    stats = server_data.__getattr__(server)
+    stats = server_data.snapshot[name]
+    note = ""
+    if (saved_at := server_data.restored_at(name)) is not None:
+        note = f"\n-# Saved <t:{round(saved_at)}:R>, the server hasn't been polled since the bot restarted."
+    elif server_data.ipc_stale:
+        note = f"\n-# Data may be stale, last heard from the server data process " \
+               f"<t:{round(time() - server_data.ipc_silent_for)}:R>."
 
     if "exception" in stats:
-        await interaction.edit_original_response(content="Error getting server data")
+        await interaction.edit_original_response(content="Error getting server data" + note)
     elif details == "all":
         await interaction.edit_original_response(content=", ".join(
-            [value for key, value in stats.items() if key not in {"players"}]))
+            [value for key, value in stats.items() if key not in {"players"}]) + note)
     elif details == "players":
-        await interaction.edit_original_response(content="", embed=PlayersEmbed(server, stats["players"]))
+        await interaction.edit_original_response(content="", embed=PlayersEmbed(name, stats["players"]))
     else:
         try:
-            await interaction.edit_original_response(content=stats[details])
+            await interaction.edit_original_response(content=stats[details] + note)
         except KeyError:
             await interaction.edit_original_response(content="Requested data isn't available for that server.")
 
 
+@app_commands.command()
+@app_commands.describe(name="DCS server selection", hours="How far back to show, up to 4 weeks")
+@app_commands.autocomplete(name=server_autocomplete)
+async def history(interaction: Interaction, name: str, hours: app_commands.Range[int, 1, 672] = 24):
+    """
+    Charts player counts for a server
+    Args:
+        name | str | Id of server
+        hours | int | Length of the charted period, ending now
+    """
+    if name not in server_dict:
+        await interaction.response.send_message("That server isn't tracked by Towerbot.", ephemeral=True)
+        return
+
+    await interaction.response.defer(thinking=True)
+    end = time()
+    start = end - hours * 3600
+    try:
+        samples = await server_data.history(name, start, end, 450)
+    except (ConnectionError, TimeoutError, RPCError) as err:
+        logging.error("Failed to get history for %s | %s", name, err)
+        await interaction.followup.send("Couldn't get server history, try again later.")
+        return
+
+    chart = await to_thread(render_history, server_dict[name], samples, start, end)
+    await interaction.followup.send(file=File(chart, filename=f"{name}_history.png"))
+
+
+@app_commands.command()
+@app_commands.describe(dcs_username="Full DCS username, or the start of one")
+async def whereis(interaction: Interaction, dcs_username: str):
+    """
+    Finds which servers a player is on or was last seen on
+    Args:
+        dcs_username | str | Username to look up, matched case insensitively
+    """
+    await interaction.response.defer(thinking=True)
+    try:
+        matches = await server_data.whereis(dcs_username, 10)
+    except (ConnectionError, TimeoutError, RPCError) as err:
+        logging.error("Failed to look up %s | %s", dcs_username, err)
+        await interaction.followup.send("Couldn't look that player up, try again later.")
+        return
+
+    if not matches:
+        await interaction.followup.send("That player hasn't been seen recently.")
+        return
+    lines = []
+    for username, server, first_seen, last_seen, online in matches:
+        if online:
+            lines.append(f"**{username}** is on {server_dict.get(server, server)} since <t:{round(first_seen)}:R>")
+        else:
+            lines.append(f"**{username}** was last seen on {server_dict.get(server, server)} <t:{round(last_seen)}:R>")
+    await interaction.followup.send("\n".join(lines), allowed_mentions=AllowedMentions.none())
+
+
 @app_commands.command()
 async def metar(interaction: Interaction, airport: str, decode: bool = False):
     # Split options into 2 different try/except statements to give better debug output if necessary
@@ -83,7 +155,7 @@ async def update_embed(interaction: Interaction):
         await interaction.response.send_message("Embed could not be found.", ephemeral=True)
     else:
         await interaction.response.send_message("Embed update sequence has begun.", ephemeral=True)
-        await active.update_embed()
+        await active.render(server_data.snapshot, force=True)
 
 
 @app_commands.command()
@@ -104,4 +176,4 @@ async def new_servers_embed(interaction: Interaction, channel: TextChannel):
         await interaction.followup.send("New embed created.", ephemeral=True)
 
 
-command_list = [info, metar, new_servers_embed, update_embed]
+command_list = [history, info, metar, new_servers_embed, update_embed, whereis]
@@ -1,67 +1,101 @@
-from discord import app_commands, Interaction
-from tb_discord.tb_ui.lesson_tracking import Requests
-from tb_db import sql_op
+from discord import AllowedMentions, app_commands, Interaction
+from lesson_counter import lesson_counts
+from lesson_index import lesson_index
+from tb_db import async_call, sql_transaction
+from tb_discord.tb_commands.filters import check_is_owner
+from tb_discord.tb_ui.lesson_tracking import lesson_name, Requests
 
 
 __all__ = ["command_list"]
 
 
+@sql_transaction
+def _register(cursor, uid: int) -> bool:
+	"""Adds a student in one statement, returns False if they were already registered"""
+	return cursor.execute("INSERT INTO students(uid) VALUES (%s) ON DUPLICATE KEY UPDATE uid = uid", (uid,)) == 1
+
+
 @app_commands.command()
 async def register(inter: Interaction):
-	if sql_op("SELECT COUNT(1) FROM students WHERE uid = %s", (inter.user.id,)) == (0,):
-		sql_op("INSERT INTO students VALUES (%s, default, default, default)", (inter.user.id,))
+	if await async_call(_register, inter.user.id):
 		await inter.response.send_message("Registered successfully", ephemeral=True)
 	else:
 		await inter.response.send_message("You have already registered with Towerbot. To unregister, please contact a DC Staff member",
 										  ephemeral=True)
 
 
+@sql_transaction
+def _request_lesson(cursor, uid: int, to_request: bytes) -> str | None:
+	"""
+	Records a lesson request for a student, with their row locked so concurrent requests can't both be recorded
+	Returns:
+		str | None | Why the request was refused, or None if it was recorded
+	"""
+	cursor.execute("SELECT requests FROM students WHERE uid = %s FOR UPDATE", (uid,))
+	if (database := cursor.fetchone()) is None:
+		return "You have not registered with Towerbot, please use /register"
+	if to_request in database[0]:
+		return "You have already requested this lesson"
+	cursor.execute("UPDATE students SET requests = CONCAT(requests, %s) WHERE uid = %s", (to_request, uid))
+	return None
+
+
 @app_commands.command()
 @app_commands.choices(branch=[
 	app_commands.Choice(name="ATSA", value=0),
 	app_commands.Choice(name="TCA", value=1)
 ])
 async def request_training(inter: Interaction, branch: int, lesson_num: int):
-	if lesson_num < 1:
+	if not 1 <= lesson_num <= 127:
 		await inter.response.send_message("That is not a valid lesson", ephemeral=True)
-
-	database = sql_op("SELECT requests FROM students where uid = %s", (inter.user.id,))
-	if database is None:
-		await inter.response.send_message("You have not registered with Towerbot, please use /register", ephemeral=True)
 		return
 
-	# Handle request in student database
-	requests = database[0]
 	# Requests are stored in the database as big-endian bits with the msb indicating which branch of the curriculum the lesson
 	# belongs to. Ex: ACAD 01: 0000_0001; TACAD 02: 1000_0010
 	to_request = ((branch << 7) + int(str(lesson_num).zfill(2))).to_bytes(1, "big", signed=False)
-	if to_request in requests:
-		await inter.response.send_message("You have already requested this lesson", ephemeral=True)
-		return
-	requests += to_request
-
-	# Log request in server database for easy counting
-	request_count_bytes = sql_op("SELECT data FROM server_data WHERE id = 0", ())[0]
-	request_counts = [(request_count_bytes[i] << 8) + request_count_bytes[i + 1] for i in range(0, len(request_count_bytes), 2)]
-	request_counts[int.from_bytes(to_request, "big", signed=False)] += 1
+	if refused := await async_call(_request_lesson, inter.user.id, to_request):
+		await inter.response.send_message(refused, ephemeral=True)
+	else:
+		# Counted in memory for easy counting, written to the database in batches
+		request = int.from_bytes(to_request, "big", signed=False)
+		lesson_counts.increment(request)
+		lesson_index.add("requests", inter.user.id, request)
+		await inter.response.send_message(f"Request processed", ephemeral=True)
 
-	# Request counts are stored in a bytestring indexed by the request number as described above. Request counts themselves are
-	# a two byte big-endian unsigned integer. Ex. ACAD-02 is stored in bytes 2 & 3
-	request_count_bytes = b"".join(map(lambda x: x.to_bytes(2, "big", signed=False), request_counts))
 
-	await inter.response.send_message(f"Request processed", ephemeral=True)
+@app_commands.command()
+@app_commands.describe(branch="Only show lessons from this branch", count="How many lessons to show")
+@app_commands.choices(branch=[
+	app_commands.Choice(name="ATSA", value=0),
+	app_commands.Choice(name="TCA", value=1)
+])
+async def lesson_requests(inter: Interaction, branch: int | None = None, count: app_commands.Range[int, 1, 25] = 5):
+	if branch is None:
+		most_requested = {lesson_branch: next(iter(lesson_counts.top(1, lesson_branch)), None) for lesson_branch in (0, 1)}
+		embed = Requests(lesson_counts.top(count), count, most_requested=most_requested)
+	else:
+		embed = Requests(lesson_counts.top(count, branch), count, branch)
+	await inter.response.send_message(embed=embed)
 
-	# Send sql updates to database
-	sql_op("UPDATE server_data SET data = %s WHERE id = 0", (request_count_bytes,))
-	sql_op("UPDATE students SET requests = %s WHERE uid = %s", (requests, inter.user.id))
+@app_commands.command()
+@check_is_owner()
+@app_commands.describe(lesson_num="Lesson number within the branch")
+@app_commands.choices(branch=[
+	app_commands.Choice(name="ATSA", value=0),
+	app_commands.Choice(name="TCA", value=1)
+])
+async def lesson_candidates(inter: Interaction, branch: int, lesson_num: app_commands.Range[int, 1, 127]):
+	"""Lists students who requested a lesson and haven't completed it, for planning a session"""
+	request = (branch << 7) + lesson_num
+	candidates = lesson_index.candidates(request)
+	if not candidates:
+		await inter.response.send_message(f"No students are waiting on {lesson_name(request)}", ephemeral=True)
+		return
 
+	lines = [f"<@{uid}>{' (attended)' if attended else ''}" for uid, attended in candidates[:50]]
+	if len(candidates) > 50:
+		lines.append(f"and {len(candidates) - 50} more")
+	await inter.response.send_message(f"{len(candidates)} student(s) waiting on {lesson_name(request)}:\n" +
+									  "\n".join(lines), ephemeral=True, allowed_mentions=AllowedMentions.none())
 
-@app_commands.command()
-async def lesson_requests(inter: Interaction):
-	request_count_bytes = sql_op("SELECT data FROM server_data WHERE id = 0", ())[0]
-	request_counts = [(request_count_bytes[i] << 8) + request_count_bytes[i + 1] for i in range(0, len(request_count_bytes), 2)]
-	atsa_requests = request_counts[:128]
-	tca_requests = request_counts[128:]
-	await inter.response.send_message(embed=Requests(atsa_requests, tca_requests))
-
-command_list = [lesson_requests, register, request_training]
+command_list = [lesson_candidates, lesson_requests, register, request_training]
@@ -1,5 +1,7 @@
 """Towerbot commands dealing with mission planning things"""
 from discord import app_commands, Interaction
+from tb_multiprocessing.io_utils import RPCError
+import logging
 import server_data
 
 
@@ -9,8 +11,15 @@ __all__ = ["command_list"]
 @app_commands.command()
 async def opt_in(interaction: Interaction, dcs_username: str):
     if len(dcs_username) <= 25:
-        server_data.log_user(dcs_username, True)
-        await interaction.response.send_message(f"You've opted in to Digital Controllers events under the username `{dcs_username}`.")
+        # Waiting on the server_data process can outlast the 3 seconds Discord allows for the first response
+        await interaction.response.defer(thinking=True)
+        try:
+            await server_data.log_user(dcs_username, True)
+        except (ConnectionError, TimeoutError, RPCError) as err:
+            logging.error("Failed to opt in %s | %s", dcs_username, err)
+            await interaction.followup.send("Your opt in could not be saved, please try again later.")
+            return
+        await interaction.followup.send(f"You've opted in to Digital Controllers events under the username `{dcs_username}`.")
     else:
         await interaction.response.send_message("DCS Usernames have a length limit of 25 characters, please try again.")
 
@@ -18,8 +27,15 @@ async def opt_in(interaction: Interaction, dcs_username: str):
 @app_commands.command()
 async def opt_out(interaction: Interaction, dcs_username: str):
     if len(dcs_username) <= 25:
-        server_data.log_user(dcs_username, False)
-        await interaction.response.send_message(f"You've opted out of Digital Controllers events under the username `{dcs_username}`.")
+        # Waiting on the server_data process can outlast the 3 seconds Discord allows for the first response
+        await interaction.response.defer(thinking=True)
+        try:
+            await server_data.log_user(dcs_username, False)
+        except (ConnectionError, TimeoutError, RPCError) as err:
+            logging.error("Failed to opt out %s | %s", dcs_username, err)
+            await interaction.followup.send("Your opt out could not be saved, please try again later.")
+            return
+        await interaction.followup.send(f"You've opted out of Digital Controllers events under the username `{dcs_username}`.")
     else:
         await interaction.response.send_message("DCS Usernames have a length limit of 25 characters, please try again.")
 
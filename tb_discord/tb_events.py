@@ -1,20 +1,23 @@
+from asyncio import gather, to_thread
 from datetime import datetime
 from discord import File, AllowedMentions
 from discord.errors import NotFound
-from os import remove
-from pathlib import Path
-from PIL import Image, ImageDraw, ImageFont
+from lesson_counter import lesson_counts
+from lesson_index import lesson_index
 from sys import argv
-from tb_db import sql_op
+from tb_db import async_sql_op
 from tb_discord import bot
-from tb_discord.tb_ui import RolesMessage, ServersEmbed
+from tb_discord.tb_ui import render_strip, RolesMessage, ServersEmbed
+from time import time
 import logging
 import random
 import re
+import server_data
 
 __all__ = []
 
 started = False
+setup_at = 0.
 # message_types returns handler function to initialize persistent message, args structured as (message, channel, data)
 message_types = [ServersEmbed.find, RolesMessage.find]
 JETS = ["F16", "F18", "F15", "F35", "F22", "A10", "F14", "MIR2"]
@@ -24,6 +27,32 @@ RUNWAYS = ["22", "04"]
 DEPARTURES = ["GAM1D", "PAL1D", "ARN1D", "TIB1D", "SOR1D", "RUD1D", "AGI1D", "DIB1D", "TUN1D", "NAL1D"]
 
 
+@bot.event
+async def setup_hook():
+    """Runs once the event loop is up, before connecting to the gateway, so the server_data process starts alongside"""
+    global setup_at
+    setup_at = time()
+    server_data.start()
+    await lesson_counts.start()
+    await lesson_index.start()
+
+
+async def restore_message(view_data: tuple):
+    try:
+        channel = bot.get_channel(int(view_data[1]))
+        assert channel is not None
+        message = await channel.fetch_message(int(view_data[0]))
+    except NotFound:
+        await async_sql_op('DELETE FROM persistent_messages WHERE message_id = %s', (view_data[0],))
+        logging.warning(f"Message of type {view_data[2]} with ID {view_data[0]} in channel {view_data[1]} could not be found.")
+        return
+    except AssertionError:
+        await async_sql_op('DELETE FROM persistent_messages WHERE message_id = %s', (view_data[0],))
+        return
+
+    await message_types[view_data[2]](message, channel, view_data[3])
+
+
 @bot.event
 async def on_ready():
     print(f"{bot.user} has connected to Discord!")
@@ -31,22 +60,14 @@ async def on_ready():
     global started
     if not started:
         started = True
+        logging.info("Connected to Discord %.2f seconds after setup", time() - setup_at)
         if "-c" not in argv:
-            role_messages = sql_op('SELECT * FROM persistent_messages', (), fetch_all=True)
-            for view_data in role_messages:
-                try:
-                    channel = bot.get_channel(int(view_data[1]))
-                    assert channel is not None
-                    message = await channel.fetch_message(int(view_data[0]))
-                except NotFound:
-                    sql_op('DELETE FROM persistent_messages WHERE message_id = %s', (view_data[0],))
-                    logging.warning(f"Message of type {view_data[2]} with ID {view_data[0]} in channel {view_data[1]} could not be found.")
-                    continue
-                except AssertionError:
-                    sql_op('DELETE FROM persistent_messages WHERE message_id = %s', (view_data[0],))
-                    continue
-
-                await message_types[view_data[2]](message, channel, view_data[3])
+            # Persistent messages don't need server data to be restored, the servers embed renders once it arrives
+            role_messages = await async_sql_op('SELECT * FROM persistent_messages', (), fetch_all=True)
+            for result in await gather(*map(restore_message, role_messages), return_exceptions=True):
+                if isinstance(result, Exception):
+                    logging.error("Failed to restore persistent message | %s", result)
+        logging.info("Ready %.2f seconds after setup", time() - setup_at)
 
 
 @bot.event
@@ -63,20 +84,6 @@ async def on_member_join(member):
         "runway": f"{random.choice(RUNWAYS)}",
         "departure": f"{random.choice(DEPARTURES)}"
     }
-    assets_path = Path(__file__).parent / "../assets"
-    strip = Image.open(assets_path / "strip_blank.png")
-    font = ImageFont.truetype(str(assets_path / "consolas.ttf"), 40)
-    font_large = ImageFont.truetype(str(assets_path / "consolas.ttf"), 70)
-    d = ImageDraw.Draw(strip)
-    d.text((67, 101), strip_text["slot"], font=font, fill=(0, 0, 0), anchor="mm")
-    d.text((305, 101), strip_text["callsign"], font=font_large, fill=(0, 0, 0), anchor="lm")
-    d.text((914, 101), strip_text["hold"], font=font_large, fill=(0, 0, 0), anchor="mm")
-    d.text((1339, 150), strip_text["aerodrome"], font=font, fill=(0, 0, 0), anchor="mm")
-    d.text((1632, 101), strip_text["runway"], font=font_large, fill=(0, 0, 0), anchor="mm")
-    d.text((1803, 101), strip_text["departure"], font=font_large, fill=(0, 0, 0), anchor="mm")
-    d.text((646, 150), strip_text["squawk"], font=font, fill=(0, 0, 0), anchor="lm")
-    d.text((646, 57), "M/" + strip_text["aircraft"], font=font, fill=(0, 0, 0), anchor="lm")
-    strip.save(fp="strip.png")
+    strip = await to_thread(render_strip, strip_text)
     await bot.get_channel(1099805424934469652).send(f"Welcome to Digital Controllers, "
-                                                    f"{member.mention}!", file=File("strip.png"))
-    remove("strip.png")
+                                                    f"{member.mention}!", file=File(strip, "strip.png"))
@@ -1,3 +1,5 @@
 """Discord embed subclasses for self-containted updates"""
 from tb_discord.tb_ui.server_embeds import *
 from tb_discord.tb_ui.role_ui import *
+from tb_discord.tb_ui.history_chart import *
+from tb_discord.tb_ui.welcome_strip import *
@@ -0,0 +1,64 @@
+"""Player count history chart for the /history command"""
+from datetime import datetime, timezone
+from io import BytesIO
+from pathlib import Path
+from PIL import Image, ImageDraw, ImageFont
+
+
+__all__ = ['render_history']
+
+assets_path = Path(__file__).parent / '../../assets'
+font = ImageFont.truetype(str(assets_path / 'consolas.ttf'), 20)
+font_large = ImageFont.truetype(str(assets_path / 'consolas.ttf'), 28)
+
+WIDTH, HEIGHT = 1000, 420
+LEFT, RIGHT, TOP, BOTTOM = 80, 920, 60, 370     # Plot area, leaving room for axis labels
+BACKGROUND = (47, 49, 54)
+GRID = (80, 83, 90)
+TEXT = (220, 221, 222)
+PLAYERS = (62, 187, 231)
+OPTED_IN = (87, 242, 135)
+
+
+def render_history(title: str, samples: list[tuple[float, int, int]], start: float, end: float) -> BytesIO:
+    """
+    Draws players and opted in players over time as a PNG, blocking so it should be run off the event loop
+    Args:
+        title | str | Chart title, the server name
+        samples | list[tuple[float, int, int]] | (time, players, opted in) samples, oldest first
+        start | float | Epoch of the left edge
+        end | float | Epoch of the right edge
+    """
+    image = Image.new('RGB', (WIDTH, HEIGHT), BACKGROUND)
+    d = ImageDraw.Draw(image)
+    d.text((LEFT, TOP // 2), title, font=font_large, fill=TEXT, anchor='lm')
+    d.text((RIGHT - 180, TOP // 2), 'players', font=font, fill=PLAYERS, anchor='rm')
+    d.text((RIGHT, TOP // 2), 'opted in', font=font, fill=OPTED_IN, anchor='rm')
+
+    # Round the y axis up to a multiple of 5 so gridlines land on whole numbers
+    peak = max([players for _, players, _ in samples], default=0)
+    top = max(5, -(-peak // 5) * 5)
+    for i in range(6):
+        y = BOTTOM - (BOTTOM - TOP) * i / 5
+        d.line([(LEFT, y), (RIGHT, y)], fill=GRID)
+        d.text((LEFT - 10, y), str(top * i // 5), font=font, fill=TEXT, anchor='rm')
+    for i in range(5):
+        x = LEFT + (RIGHT - LEFT) * i / 4
+        label = datetime.fromtimestamp(start + (end - start) * i / 4, timezone.utc).strftime('%d %b %H:%M')
+        d.text((x, BOTTOM + 20), label, font=font, fill=TEXT, anchor='mm')
+
+    def point(when: float, count: int) -> tuple[float, float]:
+        return (LEFT + (RIGHT - LEFT) * (when - start) / (end - start),
+                BOTTOM - (BOTTOM - TOP) * count / top)
+
+    if samples:
+        for column, color in ((2, OPTED_IN), (1, PLAYERS)):
+            d.line([point(sample[0], sample[column]) for sample in samples], fill=color, width=3, joint='curve')
+    else:
+        d.text(((LEFT + RIGHT) / 2, (TOP + BOTTOM) / 2), 'No data for this period', font=font_large, fill=TEXT,
+               anchor='mm')
+
+    out = BytesIO()
+    image.save(out, format='PNG', optimize=True)
+    out.seek(0)
+    return out
@@ -9,36 +9,34 @@ import logging
 import server_data
 
 
+BRANCHES = {0: ("ATSA", "ACAD"), 1: ("TCA", "TACAD")}     # Branch: (name, lesson prefix)
+
+
+def lesson_name(request: int) -> str:
+	"""Name of a lesson from its request byte, ex. 0000_0001 is ACAD-01 and 1000_0010 is TACAD-02"""
+	return f"{BRANCHES[request >> 7][1]}-{str(request & 0x7f).zfill(2)}"
+
+
 class Requests(Embed):
-	def __init__(self, atsa_data: list[int], tca_data: list[int]):
+	def __init__(self, top: list[tuple[int, int]], count: int, branch: int | None = None,
+				 most_requested: dict[int, tuple[int, int] | None] = None):
+		"""
+		Args:
+			top | list[tuple[int, int]] | Up to count (request byte, requests) pairs, most requested first
+			count | int | How many lessons were asked for
+			branch | int | None | Branch top is limited to, or None for both
+			most_requested | dict | Branch: its most requested (request byte, requests) if any, shown when branch is None
+		"""
 		super().__init__(title=f"Current Lesson Requests", color=0x3EBBE7)
 		self.set_author(name='Digital Controllers')
 		self.set_thumbnail(url="https://raw.githubusercontent.com/Digital-Controllers/website/main/docs/assets/logo.png")
 
-		if (atsa_max := max(atsa_data)) != 0:
-			requested_atsa = str(atsa_data.index(max(atsa_data))).zfill(2)
-			self.add_field(name="Most Requested ATSA Lesson:", value=f"ACAD-{requested_atsa}")
-		else:
-			self.add_field(name="Most Requested ATSA Lesson:", value=f"No requested ATSA lessons")
-
-		if (tca_max := max(tca_data)) != 0:
-			requested_tca = str(tca_data.index(max(tca_data))).zfill(2)
-			self.add_field(name="Most Requested TCA Lesson:", value=f"TACAD-{requested_tca}")
-		else:
-			self.add_field(name="Most Requested TCA Lesson:", value=f"No requested TCA lessons")
-
-		top_requested = []
-		for _ in range(5):
-			atsa_max = max(atsa_data)
-			tca_max = max(tca_data)
-			if atsa_max > tca_max:
-				top_requested.append(f"ACAD-{str(atsa_data.index(atsa_max)).zfill(2)}")
-				atsa_data[atsa_data.index(atsa_max)] = 0
-			else:
-				if tca_max == 0:
-					top_requested.append("No further requests")
-				else:
-					top_requested.append(f"TACAD-{str(tca_data.index(tca_max)).zfill(2)}")
-					tca_data[tca_data.index(tca_max)] = 0
-
-		self.add_field(name="Top 5 Requested Lessons:", value="\n".join(top_requested), inline=False)
+		for lesson_branch, lesson in (most_requested or {}).items():
+			name = BRANCHES[lesson_branch][0]
+			self.add_field(name=f"Most Requested {name} Lesson:",
+						   value=lesson_name(lesson[0]) if lesson else f"No requested {name} lessons")
+
+		branch_name = f"{BRANCHES[branch][0]} " if branch is not None else ""
+		lines = [f"{lesson_name(request)} ({requests})" for request, requests in top]
+		self.add_field(name=f"Top {count} Requested {branch_name}Lessons:",
+					   value="\n".join(lines) if lines else "No requested lessons", inline=False)
@@ -2,7 +2,7 @@ from collections import deque
 from discord import ButtonStyle, Embed, Interaction, Message, Role, TextChannel
 from discord.errors import NotFound
 from discord.ui import Button, RoleSelect, View
-from tb_db import sql_op
+from tb_db import async_sql_op
 import logging
 
 __all__ = ["RolesMessage", "RoleButtonEmbed", "RoleChoiceView", "RolesView", "RoleDeleteView"]
@@ -21,7 +21,7 @@ class RolesMessage:
     @classmethod
     async def create(cls, message: Message, channel: TextChannel, roles: list[Role]):
         new_message = await channel.send(message.content, embeds=message.embeds, view=RolesView(roles))
-        sql_op('INSERT INTO persistent_messages(message_id, channel_id, type, data) VALUES(%s, %s, %s, %s);',
+        await async_sql_op('INSERT INTO persistent_messages(message_id, channel_id, type, data) VALUES(%s, %s, %s, %s);',
                (new_message.id, channel.id, 1, ''.join([str(value.id).zfill(20) for value in roles])))
         RolesMessage.role_messages.append(RolesMessage(message=new_message, roles=roles))
         await message.delete()
@@ -122,5 +122,5 @@ class RoleDeleteButton(Button):
             await interaction.response.send_message('Could not find requested message', ephemeral=True)
         else:
             RolesMessage.role_messages.remove(self.message)
-            sql_op('DELETE FROM persistent_messages WHERE message_id = %s', (self.message.message.id,))
+            await async_sql_op('DELETE FROM persistent_messages WHERE message_id = %s', (self.message.message.id,))
             await interaction.response.defer()
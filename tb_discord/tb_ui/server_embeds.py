@@ -1,9 +1,12 @@
 """Module for ui elements based around DCS server data"""
+from asyncio import Lock
+from configs import configs
 from discord import Embed, Message, TextChannel
 from discord.abc import GuildChannel
 from discord.errors import NotFound
 from discord.ext import tasks
-from tb_db import sql_op
+from tb_db import async_sql_op
+from tb_multiprocessing.io_utils import RESTORED_KEY, Snapshot
 from time import time
 import logging
 import server_data
@@ -11,8 +14,7 @@ import server_data
 
 __all__ = ['PlayersEmbed', 'ServersEmbed']
 
-server_dict = {"gaw": "Hoggit - Georgia At War", "pgaw": "Hoggit - Persian Gulf At War",
-               "lkeu": "Lima Kilo - Flashpoint Levant - EU", "lkna": "Lima Kilo - Flashpoint Levant - NA"}
+server_dict = {source.id: source.name for source in configs.servers}
 
 
 class PlayersEmbed(Embed):
@@ -27,6 +29,7 @@ class PlayersEmbed(Embed):
 
 
 class ServersEmbed(Embed):
+    """Embed re-rendered whenever server_data receives a new frame, update_embed only watches for stale data"""
 
     active_embed = None
 
@@ -38,11 +41,11 @@ class ServersEmbed(Embed):
         self = ServersEmbed()
 
         self.message = await channel.send(embed=self)
-        await self.update_embed()
-        self.update_embed.start()
+        await self.render(server_data.snapshot)
+        self.start()
 
         ServersEmbed.active_embed = self
-        sql_op('INSERT INTO persistent_messages(message_id, channel_id, type, data) VALUES(%s, %s, %s, %s)',
+        await async_sql_op('INSERT INTO persistent_messages(message_id, channel_id, type, data) VALUES(%s, %s, %s, %s)',
                (self.message.id, channel.id, 0, ''))
 
     @classmethod
@@ -50,7 +53,7 @@ class ServersEmbed(Embed):
         """Updates existing servers embed based off of database data"""
         self = ServersEmbed()
         self.message = await message.edit(embed=self)
-        self.update_embed.start()
+        self.start()
         ServersEmbed.active_embed = self
 
     def __init__(self):
@@ -62,31 +65,69 @@ class ServersEmbed(Embed):
             url="https://raw.githubusercontent.com/Digital-Controllers/website/main/docs/assets/logo.png")
         self.set_footer(text="Want to add a new server to the embed? Propose it in #development or add a GitHub issue.")
 
-        for server in server_dict.values():
-            self.add_field(name=server, value=None, inline=False)
+        # Discord embeds are limited to 25 fields
+        if len(server_dict) > 25:
+            logging.warning('%s servers configured, only the first 25 are shown in ServersEmbed', len(server_dict))
+        self.servers = tuple(server_dict)[:25]
+        for server in self.servers:
+            self.add_field(name=server_dict[server], value=None, inline=False)
 
         self.message = None
-        self.last_time = None
+        self.rendered_version = -1
+        self.rendered_data: dict[str, tuple[bytes, float | None]] = {}
+        self.rendered_stale = False
+        self.render_lock = Lock()
+
+    def start(self):
+        """Subscribes to new server data and starts the staleness watchdog"""
+        server_data.add_listener(self.render)
+        self.update_embed.start()
 
     async def delete(self):
-        sql_op('DELETE FROM persistent_messages WHERE message_id = %s', (self.message.id,))
+        server_data.remove_listener(self.render)
+        self.update_embed.cancel()
+        await async_sql_op('DELETE FROM persistent_messages WHERE message_id = %s', (self.message.id,))
         await self.message.delete()
         ServersEmbed.active_embed = None
 
+    async def render(self, snapshot: Snapshot, force: bool = False):
+        """Edits the message to show snapshot, skipped if it is already shown unless forced"""
+        async with self.render_lock:
+            if not force and not snapshot.changed_since(self.rendered_version):
+                return
+            try:
+                restored = snapshot[RESTORED_KEY] if RESTORED_KEY in snapshot else {}
+                for i, server in enumerate(self.servers):
+                    # Only decode and format servers whose data changed since it was last rendered
+                    if server not in snapshot:
+                        continue
+                    if (rendered := (snapshot.raw(server), restored.get(server))) == self.rendered_data.get(server):
+                        continue
+                    message = ', '.join([value for key, value in snapshot[server].items() if key not in {'players'}])
+                    if (saved_at := restored.get(server)) is not None:
+                        message += f' (saved <t:{round(saved_at)}:R>, updating)'
+                    self.set_field_at(i, name=server_dict[server], value=message, inline=False)
+                    self.rendered_data[server] = rendered
+
+                # Frames are only sent when data changes, so staleness comes from the process going quiet instead
+                if stale := server_data.ipc_stale:
+                    silent_for = server_data.ipc_silent_for
+                    self.description = f"Data is stale, last heard from the server data process " \
+                                       f"<t:{round(time() - silent_for)}:R>."
+                    logging.warning('ServersEmbed has not heard from the server data process for %s seconds',
+                                    round(silent_for))
+                else:
+                    self.description = "Updated in real-time."
+
+                await self.message.edit(embed=self)
+                self.rendered_version = snapshot.version
+                self.rendered_stale = stale
+            except NotFound:
+                await self.delete()
+            except Exception as err:
+                logging.error(err)
+
     @tasks.loop(seconds=120)
     async def update_embed(self):
-        try:
-            if self.last_time and (delta := time() - self.last_time) > 120:
-                logging.warning('ServersEmbed update timer took %s seconds', delta)
-            update_data = (('gaw', server_data.gaw), ('pgaw', server_data.pgaw),
-                           ('lkeu', server_data.lkeu), ('lkna', server_data.lkna))
-            for i in range(len(update_data)):
-                server_name, server_info = update_data[i]
-                message = ', '.join([value for key, value in server_info.items() if key not in {'players'}])
-                self.set_field_at(i, name=server_dict[server_name], value=message, inline=False)
-            await self.message.edit(embed=self)
-            self.last_time = time()
-        except NotFound:
-            await self.delete()
-        except Exception as err:
-            logging.error(err)
+        """Watchdog, catches missed updates and marks the embed stale if the server_data process goes quiet"""
+        await self.render(server_data.snapshot, force=server_data.ipc_stale or self.rendered_stale)
@@ -0,0 +1,96 @@
+"""Flight strip image welcoming new members, drawn on a template loaded once"""
+from io import BytesIO
+from pathlib import Path
+from PIL import Image, ImageDraw, ImageFont
+
+
+__all__ = ['render_strip']
+
+assets_path = Path(__file__).parent / '../../assets'
+with Image.open(assets_path / 'strip_blank.png') as template:
+    template.load()     # Decoded now so every render only copies pixels
+font = ImageFont.truetype(str(assets_path / 'consolas.ttf'), 40)
+font_large = ImageFont.truetype(str(assets_path / 'consolas.ttf'), 70)
+INK = (0, 0, 0)
+
+# Field: (position, font, anchor)
+FIELDS = {'slot': ((67, 101), font, 'mm'),
+          'callsign': ((305, 101), font_large, 'lm'),
+          'hold': ((914, 101), font_large, 'mm'),
+          'aerodrome': ((1339, 150), font, 'mm'),
+          'runway': ((1632, 101), font_large, 'mm'),
+          'departure': ((1803, 101), font_large, 'mm'),
+          'squawk': ((646, 150), font, 'lm'),
+          'aircraft': ((646, 57), font, 'lm')}
+
+
+def render_strip(strip_text: dict[str, str]) -> BytesIO:
+    """
+    Fills in a blank flight strip as a PNG, blocking so it should be run off the event loop. Only reads the shared
+    template and fonts, so any number of strips can be rendered at once.
+    Args:
+        strip_text | dict[str, str] | Text for every key in FIELDS
+    """
+    strip = template.copy()
+    d = ImageDraw.Draw(strip)
+    for field, (position, field_font, anchor) in FIELDS.items():
+        text = 'M/' + strip_text[field] if field == 'aircraft' else strip_text[field]
+        d.text(position, text, font=field_font, fill=INK, anchor=anchor)
+    out = BytesIO()
+    strip.save(out, format='PNG', compress_level=1)     # Strips are posted once, encoding speed matters over size
+    out.seek(0)
+    return out
+
+
+# Simulates a join raid, rendering strips for concurrent joins the way on_member_join used to (reloading the template
+# and fonts, on the event loop, through a shared file) and the way it does now, and reports joins/sec and the longest
+# the event loop was blocked for
+if __name__ == '__main__':
+    from asyncio import gather, run, to_thread
+    from os import remove
+    from sys import path
+    from tempfile import TemporaryDirectory
+    from time import perf_counter
+
+    path.append(str(Path(__file__).parent.parent.parent))
+    from loop_lag import max_lag_during
+
+    JOINS = 200
+    text = {'slot': '12:34', 'squawk': '6777', 'callsign': 'PILO42', 'aircraft': 'F16', 'hold': 'A',
+            'aerodrome': 'UG5X', 'runway': '22', 'departure': 'GAM1D'}
+
+    async def old_join(strip_path: Path):
+        strip = Image.open(assets_path / 'strip_blank.png')
+        old_font = ImageFont.truetype(str(assets_path / 'consolas.ttf'), 40)
+        old_font_large = ImageFont.truetype(str(assets_path / 'consolas.ttf'), 70)
+        d = ImageDraw.Draw(strip)
+        for field, (position, field_font, anchor) in FIELDS.items():
+            d.text(position, 'M/' + text[field] if field == 'aircraft' else text[field],
+                   font=old_font_large if field_font is font_large else old_font, fill=INK, anchor=anchor)
+        strip.save(fp=strip_path)
+        with open(strip_path, 'rb') as fd:    # discord.File reading it back
+            fd.read()
+        remove(strip_path)
+
+    async def new_join(_):
+        (await to_thread(render_strip, text)).read()
+
+    async def raid(join, strip_path: Path) -> tuple[float, float]:
+        elapsed = 0.
+
+        async def joins():
+            nonlocal elapsed
+            start = perf_counter()
+            await gather(*(join(strip_path) for _ in range(JOINS)))
+            elapsed = perf_counter() - start
+
+        max_lag = await max_lag_during(joins)
+        return JOINS / elapsed, max_lag
+
+    async def main():
+        with TemporaryDirectory() as tmp:
+            for name, join in (('old', old_join), ('new', new_join)):
+                rate, lag = await raid(join, Path(tmp) / 'strip.png')
+                print(f'{name} | {JOINS} joins: {rate:.0f} joins/s, max event loop lag {lag * 1000:.0f}ms')
+
+    run(main())
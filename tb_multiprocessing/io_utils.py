@@ -1,52 +1,386 @@
 """Provides utility functions and classes for communication between processes"""
-from copy import deepcopy
-from selectors import DefaultSelector, EVENT_READ
+from asyncio import BufferedProtocol
+from os import replace
+from pathlib import Path
+from struct import error as StructError, Struct
+from threading import Lock
+from types import MappingProxyType
+from typing import Callable
 import logging
 
 
+# Frame types, sent as the first byte of every frame, see encoding.txt
+SNAPSHOT_FRAME = 0x00   # Poller to bot, dict of server data by source id
+RPC_FRAME = 0x01        # Bot to poller, (request id, method name, args)
+ACK_FRAME = 0x02        # Poller to bot, (request id, succeeded, result or error message)
+HEARTBEAT_FRAME = 0x03  # Poller to bot, time sent as a float
+
+
+class RPCError(Exception):
+	"""Raised on the calling side when a remote procedure call fails in the other process"""
+	pass
+
+
+def make_frame(kind: int, msg: bytes) -> bytes:
+	"""Prefixes an encoded message with its frame type and the length of both"""
+	return (len(msg) + 1).to_bytes(3, "big", signed=False) + bytes((kind,)) + msg
+
+
 class SocketHandler:
-	def __init__(self, conn, *, recieving=True):
+	"""Sends and receives frames over a blocking socket, writes may come from multiple threads"""
+	def __init__(self, conn):
 		self.conn = conn
-		self.recieving = recieving
-		if recieving:
-			self.monitor = DefaultSelector()
-			self.monitor.register(conn, EVENT_READ)
-			self.previous = "\x074\x11\x062\x11\x01exception\x10\x01Update has not yet run\x10\x062\x11\x01exception\x10\x01Update has not yet run\x10\x062\x11\x01exception\x10\x01Update has not yet run\x10\x062\x11\x01exception\x10\x01Update has not yet run\x00"
+		self.write_lock = Lock()
+
+	def write(self, msg: bytes, kind: int = SNAPSHOT_FRAME):
+		frame = make_frame(kind, msg)
+		with self.write_lock:
+			self.conn.sendall(frame)
+
+	def read(self) -> tuple[int, memoryview]:
+		"""Blocks until a whole frame has been received, returns its type and body"""
+		frame = self._read_exactly(int.from_bytes(self._read_exactly(3), "big", signed=False))
+		return frame[0], memoryview(frame)[1:]
+
+	def _read_exactly(self, length: int) -> bytearray:
+		buf = bytearray(length)
+		view = memoryview(buf)
+		filled = 0
+		while filled < length:
+			if not (received := self.conn.recv_into(view[filled:])):
+				raise ConnectionError("Socket closed by main process")
+			filled += received
+		return buf
+
+
+class FrameProtocol(BufferedProtocol):
+	"""
+	Receives frames on the event loop. Each frame is read straight into a bytearray preallocated to the length from
+	its header, which is then handed off to on_frame as its type and body and never touched again.
+	"""
+	def __init__(self, on_frame: Callable[[int, memoryview], None],
+				 on_lost: Callable[[Exception | None], None] = None):
+		self.on_frame = on_frame
+		self.on_lost = on_lost
+		self.header = bytearray(3)
+		self.frame = None   # None while reading a header
+		self.filled = 0
+		self.transport = None
+
+	def connection_made(self, transport):
+		self.transport = transport
+
+	def write(self, msg: bytes, kind: int):
+		self.transport.write(make_frame(kind, msg))
+
+	def get_buffer(self, sizehint: int) -> memoryview:
+		return memoryview(self.header if self.frame is None else self.frame)[self.filled:]
+
+	def buffer_updated(self, nbytes: int):
+		self.filled += nbytes
+		if self.frame is None:
+			if self.filled < 3:
+				return
+			self.frame = bytearray(int.from_bytes(self.header, "big", signed=False))
+			self.filled = 0
+
+		if self.filled == len(self.frame):
+			frame = self.frame
+			self.frame = None
+			self.filled = 0
+			try:
+				self.on_frame(frame[0], memoryview(frame)[1:])
+			except Exception as err:
+				logging.error("Error handling %s byte frame | %s", len(frame), err)
+
+	def connection_lost(self, exc: Exception | None):
+		logging.warning("Frame connection lost | %s", exc)
+		if self.on_lost:
+			self.on_lost(exc)
+
+
+class Snapshot:
+	"""
+	Immutable, versioned view of one dict frame from the server_data process. The frame is indexed once on creation,
+	decoding only its keys, and each value is only decoded the first time it is accessed.
+	"""
+	__slots__ = ("version", "received_at", "_frame", "_spans", "_values")
+
+	def __init__(self, frame: bytes | memoryview, version: int, received_at: float):
+		buf = memoryview(frame)
+		if not len(buf) or buf[0] != CODEC_VERSION:
+			raise ValueError(f"Message is not encoded with codec version {CODEC_VERSION}")
+		if len(buf) < 2 or buf[1] != DICT_TAG:
+			raise ValueError("Snapshot frames must contain a dict")
+
+		try:
+			length, pos = _read_varint(buf, 2)
+			spans = {}
+			for _ in range(length):
+				key, start = _decode_from(buf, pos)
+				pos = _skip_value(buf, start)
+				spans[key] = (start, pos)
+		except (IndexError, StructError):
+			raise ValueError("Snapshot frame ends mid value") from None
+		if pos > len(buf):
+			raise ValueError("Snapshot frame ends mid value")
+
+		object.__setattr__(self, "version", version)
+		object.__setattr__(self, "received_at", received_at)
+		object.__setattr__(self, "_frame", buf)
+		object.__setattr__(self, "_spans", spans)
+		object.__setattr__(self, "_values", {})
+
+	def __setattr__(self, key, value):
+		raise AttributeError("Snapshot is immutable")
+
+	def __len__(self) -> int:
+		return len(self._spans)
+
+	def __contains__(self, key) -> bool:
+		return key in self._spans
+
+	def __iter__(self):
+		return iter(self._spans)
+
+	def __getitem__(self, key):
+		"""Decodes the value for key on first access, dicts are returned as read-only mappings"""
+		if (value := self._values.get(key)) is None:
+			start, end = self._spans[key]
+			value, _ = _decode_from(self._frame[start:end], 0)
+			if type(value) is dict:
+				value = MappingProxyType(value)
+			self._values[key] = value
+		return value
+
+	def raw(self, key) -> bytes:
+		"""Encoded value for key, cheap to compare against another snapshot's without decoding either"""
+		start, end = self._spans[key]
+		return self._frame[start:end].tobytes()
+
+	def changed_since(self, version: int) -> bool:
+		"""Whether this snapshot is newer than version, never decodes anything"""
+		return self.version > version
+
+
+CODEC_VERSION = 2
+
+# Type tags, see encoding.txt
+STR_TAG = 0x01
+INT_TAG = 0x02
+TRUE_TAG = 0x03
+FALSE_TAG = 0x04
+FLOAT_TAG = 0x05
+DICT_TAG = 0x06
+LIST_TAG = 0x07
+TUPLE_TAG = 0x08
+SET_TAG = 0x0a
+
+collection_tags = {list: LIST_TAG, tuple: TUPLE_TAG, set: SET_TAG}
+tag_collections = {tag: value_type for value_type, tag in collection_tags.items()}
+float_struct = Struct(">d")
+
+
+def _write_varint(out: bytearray, value: int):
+	"""Appends an unsigned LEB128 varint to out"""
+	while value > 0x7f:
+		out.append((value & 0x7f) | 0x80)
+		value >>= 7
+	out.append(value)
+
+
+def _read_varint(buf: memoryview, pos: int) -> tuple[int, int]:
+	"""Reads an unsigned LEB128 varint from buf at pos, returns (value, position after varint)"""
+	value = 0
+	shift = 0
+	while True:
+		byte = buf[pos]
+		pos += 1
+		value |= (byte & 0x7f) << shift
+		if byte < 0x80:
+			return value, pos
+		shift += 7
+
+
+def _encode_into(out: bytearray, value):
+	"""Recursively appends the tagged encoding of value to out"""
+	value_type = type(value)
+
+	if value_type is str:
+		encoded = value.encode()
+		out.append(STR_TAG)
+		_write_varint(out, len(encoded))
+		out += encoded
+
+	elif value_type is bool:
+		out.append(TRUE_TAG if value else FALSE_TAG)
+
+	elif value_type is int:
+		out.append(INT_TAG)
+		# Zigzag so small negative numbers stay small
+		_write_varint(out, value << 1 if value >= 0 else ((-value) << 1) - 1)
+
+	elif value_type is float:
+		out.append(FLOAT_TAG)
+		out += float_struct.pack(value)
+
+	elif value_type is dict:
+		out.append(DICT_TAG)
+		_write_varint(out, len(value))
+		for key, item in value.items():
+			_encode_into(out, key)
+			_encode_into(out, item)
+
+	elif value_type in collection_tags:
+		out.append(collection_tags[value_type])
+		_write_varint(out, len(value))
+		for item in value:
+			_encode_into(out, item)
+
+	else:
+		raise TypeError(f"Cannot network encode value of type {value_type.__name__}")
+
+
+def _decode_from(buf: memoryview, pos: int) -> tuple[object, int]:
+	"""Recursively decodes the value at pos, returns (value, position after value)"""
+	tag = buf[pos]
+	pos += 1
+
+	if tag == STR_TAG:
+		length, pos = _read_varint(buf, pos)
+		end = pos + length
+		if end > len(buf):
+			raise IndexError("String runs past the end of the message")
+		return str(buf[pos:end], "utf-8"), end
+
+	elif tag == INT_TAG:
+		zigzag, pos = _read_varint(buf, pos)
+		return (zigzag >> 1) if not zigzag & 1 else -((zigzag + 1) >> 1), pos
+
+	elif tag == TRUE_TAG:
+		return True, pos
+
+	elif tag == FALSE_TAG:
+		return False, pos
+
+	elif tag == FLOAT_TAG:
+		return float_struct.unpack_from(buf, pos)[0], pos + 8
+
+	elif tag == DICT_TAG:
+		length, pos = _read_varint(buf, pos)
+		out = {}
+		for _ in range(length):
+			key, pos = _decode_from(buf, pos)
+			out[key], pos = _decode_from(buf, pos)
+		return out, pos
+
+	elif tag in tag_collections:
+		length, pos = _read_varint(buf, pos)
+		out = []
+		for _ in range(length):
+			item, pos = _decode_from(buf, pos)
+			out.append(item)
+		value_type = tag_collections[tag]
+		return (out if value_type is list else value_type(out)), pos
+
+	raise ValueError(f"Unknown type tag {tag:#04x} at byte {pos - 1}")
+
+
+def _skip_value(buf: memoryview, pos: int) -> int:
+	"""Returns the position after the value at pos without decoding it"""
+	tag = buf[pos]
+	pos += 1
+
+	if tag == STR_TAG:
+		length, pos = _read_varint(buf, pos)
+		return pos + length
+
+	elif tag == INT_TAG:
+		return _read_varint(buf, pos)[1]
+
+	elif tag in {TRUE_TAG, FALSE_TAG}:
+		return pos
+
+	elif tag == FLOAT_TAG:
+		return pos + 8
 
-	def write(self, msg: bytes):
-		if self.recieving:
-			raise NotImplementedError
+	elif tag == DICT_TAG or tag in tag_collections:
+		length, pos = _read_varint(buf, pos)
+		for _ in range(length * 2 if tag == DICT_TAG else length):
+			pos = _skip_value(buf, pos)
+		return pos
 
-		self.conn.sendall(len(msg).to_bytes(3, "big", signed=False) + msg)
+	raise ValueError(f"Unknown type tag {tag:#04x} at byte {pos - 1}")
 
-	def read(self) -> str:
-		if not self.recieving:
-			raise NotImplementedError
 
-		if not self.monitor.select(0):
-			return self.previous
+def network_encode(to_encode) -> bytes:
+	"""Encodes a str/int/bool/float/dict/list/tuple/set structure to a versioned binary message"""
+	out = bytearray((CODEC_VERSION,))
+	_encode_into(out, to_encode)
+	return bytes(out)
 
-		while self.monitor.select(0):
-			length = int.from_bytes(self.conn.recv(3), "big", signed=False)
-			read = 0
-			msg = b""
-			while read < length:
-				to_read = min(length - read, 2048)
-				chunk = self.conn.recv(to_read)
-				msg += chunk
-				read += to_read
 
-		self.previous = msg.decode()
-		return deepcopy(self.previous)
+def network_decode(value: bytes | bytearray | memoryview):
+	"""Decodes a message created by network_encode to original data without copying the underlying buffer"""
+	buf = memoryview(value)
+	if not len(buf) or buf[0] != CODEC_VERSION:
+		raise ValueError(f"Message is not encoded with codec version {CODEC_VERSION}")
 
+	try:
+		out, end = _decode_from(buf, 1)
+	except (IndexError, StructError):
+		# Reads past the end of a truncated message, ex. a partially written snapshot file
+		raise ValueError("Message ends mid value") from None
+	if end != len(buf):
+		raise ValueError(f"{len(buf) - end} trailing byte(s) after decoded message")
+	return out
 
 
-value_keywords = {"\x01": str, "\x02": int, "\x03": bool, "\x04": bool, "\x05": float,
+# =======PERSISTED SNAPSHOTS=======
+
+
+RESTORED_KEY = "_restored"  # Snapshot key mapping source ids still showing saved data to when it was saved
+
+
+def write_atomic(path: Path, data: bytes):
+	"""Writes a file so it either fully replaces the previous one or not at all"""
+	tmp = path.with_suffix(".tmp")
+	with open(tmp, "wb") as file:
+		file.write(data)
+	replace(tmp, path)
+
+
+def load_snapshot(path: Path) -> dict | None:
+	"""
+	Loads a snapshot saved with write_atomic with every source marked as restored, keeping when it was saved if it
+	already was, or returns None if there isn't a usable one
+	"""
+	try:
+		saved_at = path.stat().st_mtime
+		saved = network_decode(path.read_bytes())
+	except FileNotFoundError:
+		return None
+	except (OSError, ValueError) as err:
+		logging.error("Ignoring unreadable saved snapshot %s | %s", path, err)
+		return None
+	if type(saved) is not dict:
+		return None
+
+	restored = saved.get(RESTORED_KEY, {})
+	saved[RESTORED_KEY] = {source: restored.get(source, saved_at) for source in saved if source != RESTORED_KEY}
+	return saved
+
+
+# =======VERSION 1 TEXT CODEC=======
+# Superseded by the binary codec above, only retained to benchmark against below
+
+
+_text_value_keywords = {"\x01": str, "\x02": int, "\x03": bool, "\x04": bool, "\x05": float,
 				  "\x06": dict, "\x07": list, "\x08": tuple, "\x0a": set}
-collection_delims = {"\x06", "\x07", "\x08", "\x0a"}
+_text_collection_delims = {"\x06", "\x07", "\x08", "\x0a"}
 
 
-def network_encode(to_encode):
+def _text_encode(to_encode):
 	encode_type = type(to_encode)
 
 	if encode_type == str:
@@ -65,34 +399,34 @@ def network_encode(to_encode):
 	elif encode_type == dict:
 		out_list = []
 		for key, value in to_encode.items():
-			encoded_key = network_encode(key)[:-1]
-			encoded_value = network_encode(value)[:-1]
+			encoded_key = _text_encode(key)[:-1]
+			encoded_value = _text_encode(value)[:-1]
 			out_list += [encoded_key, encoded_value]
 		return b"\x06" + str(len(out_list)).encode() + b"\x11" + b"\x10".join(out_list) + b"\x00"
 
 	elif encode_type == list:
 		out_list = []
 		for value in to_encode:
-			encoded_value = network_encode(value)[:-1]
+			encoded_value = _text_encode(value)[:-1]
 			out_list.append(encoded_value)
 		return b"\x07" + str(len(out_list)).encode() + b"\x11" + b"\x10".join(out_list) + b"\x00"
 
 	elif encode_type == tuple:
 		out_list = []
 		for value in to_encode:
-			encoded_value = network_encode(value)[:-1]
+			encoded_value = _text_encode(value)[:-1]
 			out_list.append(encoded_value)
 		return b"\x08" + str(len(out_list)).encode() + b"\x11" + b"\x10".join(out_list) + b"\x00"
 
 	elif encode_type == set:
 		out_list = []
 		for value in to_encode:
-			encoded_value = network_encode(value)[:-1]
+			encoded_value = _text_encode(value)[:-1]
 			out_list.append(encoded_value)
 		return b"\x0a" + str(len(out_list)).encode() + b"\x11" + b"\x10".join(out_list) + b"\x00"
 
 
-def network_decode(value: str):
+def _text_decode(value: str):
 	"""Recursively decodes strings to original data"""
 	def internal_len(to_len) -> int:
 		"""Recursively gets total length of collection including sub-collections"""
@@ -107,7 +441,7 @@ def network_decode(value: str):
 			counter += internal_len(i)
 		return counter
 
-	value_type = value_keywords[value[0]]
+	value_type = _text_value_keywords[value[0]]
 
 	if value_type in {list, tuple, set, dict}:
 		data_chunks = value[value.index("\x11") + 1:].split("\x10")
@@ -116,11 +450,11 @@ def network_decode(value: str):
 		i = 0
 		ind = 0
 		while i < length:   # Iterate length of collection
-			if data_chunks[ind][0] in collection_delims:
-				val = network_decode("\x10".join(data_chunks[ind:]))
+			if data_chunks[ind][0] in _text_collection_delims:
+				val = _text_decode("\x10".join(data_chunks[ind:]))
 				ind += internal_len(val)
 			else:
-				val = network_decode(data_chunks[ind])
+				val = _text_decode(data_chunks[ind])
 				ind += 1
 			i += 1
 			out.append(val)
@@ -167,5 +501,80 @@ if __name__ == "__main__":
 	  {"exception": "Getting data from server failed"}, {"exception": "Getting data from server failed"}]]
 	for test in tests:
 		encoded = network_encode(test)
-		decoded = network_decode(encoded.decode())
+		decoded = network_decode(encoded)
 		print(test == decoded, "|", encoded, "|", decoded)
+
+	# Types and edge cases the text codec never supported
+	binary_tests = \
+	[-1,
+	 -2 ** 70,
+	 2 ** 70,
+	 1.5,
+	 -0.25,
+	 "",
+	 "unicode \u00e9\u4e2d \x00\x10\x11 separators",
+	 [],
+	 {},
+	 (),
+	 set(),
+	 [[], {}, ("",)],
+	 {"players": [("user", "Opted in"), ("other", "Unknown")], "count": 2, "ok": True, "uptime": 1234.5}]
+	for test in binary_tests:
+		encoded = network_encode(test)
+		decoded = network_decode(memoryview(encoded))
+		print(test == decoded and type(test) == type(decoded), "|", encoded, "|", decoded)
+
+	# Snapshots index the frame once and decode each item only when accessed
+	snapshot_test = dict(enumerate(binary_tests))
+	snapshot = Snapshot(network_encode(snapshot_test), 1, 0.0)
+	print(len(snapshot) == len(snapshot_test) and all(snapshot[key] == value for key, value in snapshot_test.items()),
+		  "|", snapshot.changed_since(0), snapshot.changed_since(1), snapshot.raw(0) == network_encode(-1)[1:])
+
+	# Saved snapshots keep when each source was first saved across repeated restores
+	from tempfile import TemporaryDirectory
+
+	with TemporaryDirectory() as directory:
+		path = Path(directory) / "snapshot.bin"
+		write_atomic(path, network_encode({"a": {"x": "1"}, "b": {"x": "2"}, RESTORED_KEY: {"b": 1.0}}))
+		loaded = load_snapshot(path)
+		print(loaded[RESTORED_KEY] == {"a": path.stat().st_mtime, "b": 1.0} and loaded["a"] == {"x": "1"}, "|",
+			  not path.with_suffix(".tmp").exists(), load_snapshot(Path(directory) / "missing.bin") is None)
+
+		# A snapshot cut off anywhere is ignored rather than stopping either process from starting
+		saved = path.read_bytes()
+		logging.disable(logging.ERROR)
+		for end in range(len(saved)):
+			path.write_bytes(saved[:end])
+			assert load_snapshot(path) is None, f"loaded a snapshot cut off at byte {end}"
+			try:
+				Snapshot(saved[:end], 1, 0.0)
+			except ValueError:
+				pass
+		logging.disable(logging.NOTSET)
+		print(True, "| truncated snapshots rejected")
+
+	# Throughput against the text codec on a large hoggit player list
+	from time import perf_counter
+
+	def benchmark(encode, decode, payload, runs: int) -> tuple[float, float, int]:
+		start = perf_counter()
+		for _ in range(runs):
+			encoded = encode(payload)
+		encode_time = (perf_counter() - start) / runs
+		start = perf_counter()
+		for _ in range(runs):
+			assert decode(encoded) == payload
+		return encode_time, (perf_counter() - start) / runs, len(encoded)
+
+	for player_count in (100, 500, 2000):
+		server = {"player_count": f"{player_count} player(s) online",
+				  "players": [(f"Player {i:05}", ("Opted in", "Opted out", "Unknown")[i % 3]) for i in range(player_count)],
+				  "metar": "METAR: `UGKO 211200Z 27005KT 9999 SCT030 15/10 Q1015`",
+				  "restart": "restart <t:1700000000:R>"}
+		payload = [server, server, server, server]
+		text_results = benchmark(_text_encode, lambda msg: _text_decode(msg.decode()), payload, 3)
+		binary_results = benchmark(network_encode, network_decode, payload, 3)
+		print(f"{player_count * 4} players | "
+			  f"text: encode {text_results[0] * 1000:.2f}ms, decode {text_results[1] * 1000:.2f}ms, {text_results[2]} bytes | "
+			  f"binary: encode {binary_results[0] * 1000:.2f}ms, decode {binary_results[1] * 1000:.2f}ms, "
+			  f"{binary_results[2]} bytes | decode speedup {text_results[1] / binary_results[1]:.1f}x")
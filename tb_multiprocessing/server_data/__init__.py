@@ -1,10 +1,10 @@
 from pathlib import Path
 from sys import executable, platform
+from tb_multiprocessing.supervisor import Supervisor
 import socket
-import subprocess
 
 
-__all__ = ["stop", "conn"]
+__all__ = ["snapshot_path", "stop", "supervisor"]
 
 
 sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
@@ -12,20 +12,18 @@ sock.bind(("localhost", 20250))
 
 sock.listen(1)
 
-process = subprocess.Popen([executable, Path(__file__).parent / "main.py"])
+snapshot_path = Path(__file__).parent / "snapshot.bin"     # Saved by the process after every update
 
-conn, addr = sock.accept()
-conn.settimeout(3)
+# Only bound here, the process is spawned by server_data.start once the event loop is running
+supervisor = Supervisor([executable, Path(__file__).parent / "main.py"], sock, name="server_data process")
 
 if platform == "win32":
     from signal import CTRL_C_EVENT
 
     def stop():
-        process.send_signal(CTRL_C_EVENT)
-        sock.close()
+        supervisor.stop(CTRL_C_EVENT)
 else:
     from signal import SIGINT
 
     def stop():
-        process.send_signal(SIGINT)
-        sock.close()
+        supervisor.stop(SIGINT)
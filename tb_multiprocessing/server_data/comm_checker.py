@@ -1,50 +1,74 @@
 from pathlib import Path
 from sys import path
+from threading import Lock
 
 path.append(str(Path(__file__).parent.parent.parent))
 
-from tb_db import sql_func, sql_op
+from tb_db import sql_op
 
-__all__ = ["check_usernames", "log_user"]
+__all__ = ["check_usernames", "comms_dict", "label_players", "log_user", "username_key", "warm_cache"]
 
 
 def check_usernames(data_dict: dict) -> dict:
 	"""
-	Extracts usernames from server data, checks against opt in/out database, inserts database values, and returns server data
+	Extracts usernames from server data, checks against the opt in/out cache, inserts cached values, and returns server
+	data
 	Args:
 		data_dict | dict | Data dictionary reutrned from hoggit.get_hoggit or limakilo.get_lk
 	Returns:
-		data_dict | dict | Data dictionary updated with database data
+		data_dict | dict | Data dictionary updated with opt in/out states
 	"""
 	# Catches any server exceptions without wasting bandwidth and slowing processing
 	if "exception" in data_dict.keys():
 		return data_dict
 
-	usernames = data_dict["players"]
-	player_states = sql_op(["SELECT comms FROM user_comms WHERE username = %s;"] * len(usernames),
-						   [(uname,) for uname in usernames])
-	user_data = [(uname, comms_dict[comms_data]) for uname, comms_data in zip(usernames, player_states)]
-
-	data_dict["players"] = user_data
+	data_dict["players"] = label_players(data_dict["players"])
 	return data_dict
 
 
-@sql_func
-def log_user(db_conn, cursor, username: str, state: bool):
+def label_players(usernames: list[str]) -> list[tuple[str, str]]:
+	"""Pairs each username with its opt in/out state from the cache, without touching the database"""
+	return [(uname, comms_dict[comms_cache.get(username_key(uname))]) for uname in usernames]
+
+
+def warm_cache():
+	"""Replaces the opt in/out cache with the whole user_comms table, picking up changes made outside this process"""
+	global comms_cache, logged_while_loading
+	with cache_lock:
+		logged_while_loading = []
+	rows = sql_op("SELECT username, comms FROM user_comms;", (), fetch_all=True)
+	cache = {username_key(username): comms for username, comms in rows}
+	with cache_lock:
+		# Writes committed after the SELECT started may be missing from it, reapplying earlier ones is harmless
+		for key, comms in logged_while_loading:
+			cache[key] = comms
+		comms_cache = cache
+		logged_while_loading = None
+
+
+def username_key(username: str) -> str:
+	"""Approximates the database's case insensitive, trailing space insensitive comparison of usernames"""
+	return username.casefold().rstrip(" ")
+
+
+def log_user(username: str, state: bool):
 	"""
-	Logs a user as opt in or out in database
+	Logs a user as opt in or out in database, then in the cache once the database write has succeeded
 	Args:
 		username | str | username of user
 		state | bool | Whether they opted in (True) or opted out (False)
 	Returns:
 		None
 	"""
-	cursor.execute("SELECT * FROM user_comms WHERE username = %s;", (username,))
-	if cursor.fetchone():
-		cursor.execute("UPDATE user_comms SET comms = %s WHERE username = %s;", (int(state), username))
-	else:
-		cursor.execute("INSERT INTO user_comms(username, comms) VALUES (%s, %s);", (username, int(state)))
-	db_conn.commit()
+	sql_op("INSERT INTO user_comms(username, comms) VALUES (%s, %s) ON DUPLICATE KEY UPDATE comms = VALUES(comms);",
+		   (username, int(state)))
+	with cache_lock:
+		comms_cache[username_key(username)] = int(state)
+		if logged_while_loading is not None:
+			logged_while_loading.append((username_key(username), int(state)))
 
 
-comms_dict = {(0,): "Opted out", (1,): "Opted in", None: "Unknown"}
+comms_dict = {0: "Opted out", 1: "Opted in", None: "Unknown"}
+comms_cache: dict[str, int] = {}	# username_key(username): comms
+cache_lock = Lock()	# log_user runs on the RPC listener thread while warm_cache runs on the main thread
+logged_while_loading: list[tuple[str, int]] | None = None	# log_user writes made while warm_cache is loading
@@ -0,0 +1,190 @@
+"""Bounded player count history for the server_data process"""
+from array import array
+from io_utils import write_atomic
+from pathlib import Path
+from struct import error as StructError, Struct
+import logging
+
+__all__ = ["History", "SampleRing"]
+
+
+class SampleRing:
+	"""
+	Fixed capacity ring of (time, players, opted in) samples in typed arrays, 12 bytes a sample. Samples must be
+	appended in time order, which lets range queries binary search instead of scanning.
+	"""
+	def __init__(self, capacity: int):
+		self.capacity = capacity
+		self.times = array("d", bytes(8 * capacity))
+		self.players = array("H", bytes(2 * capacity))
+		self.opted_in = array("H", bytes(2 * capacity))
+		self.start = 0  # Physical index of the oldest sample
+		self.size = 0
+
+	def __len__(self) -> int:
+		return self.size
+
+	def append(self, when: float, players: int, opted_in: int):
+		"""
+		Adds a sample, overwriting the oldest once full. Counts are clamped to what the arrays hold, ex. -1 players
+		from a source counting the server itself.
+		Raises:
+			ValueError | when is before the newest sample, ex. after the clock stepped back
+		"""
+		if self.size and when < self.times[(self.start + self.size - 1) % self.capacity]:
+			raise ValueError("Samples must be appended in time order")
+		players, opted_in = max(0, min(int(players), 0xffff)), max(0, min(int(opted_in), 0xffff))
+		if self.size < self.capacity:
+			i = (self.start + self.size) % self.capacity
+			self.size += 1
+		else:
+			i = self.start
+			self.start = (self.start + 1) % self.capacity
+		self.times[i] = when
+		self.players[i] = players
+		self.opted_in[i] = opted_in
+
+	def _bisect(self, when: float) -> int:
+		"""Logical index of the first sample at or after when"""
+		low, high = 0, self.size
+		while low < high:
+			mid = (low + high) // 2
+			if self.times[(self.start + mid) % self.capacity] < when:
+				low = mid + 1
+			else:
+				high = mid
+		return low
+
+	def range(self, start: float, end: float) -> list[tuple[float, int, int]]:
+		"""Samples from start up to but excluding end, oldest first"""
+		first, last = self._bisect(start), self._bisect(end)
+		samples = []
+		for logical in range(first, last):
+			i = (self.start + logical) % self.capacity
+			samples.append((self.times[i], self.players[i], self.opted_in[i]))
+		return samples
+
+	def ordered(self) -> tuple[array, array, array]:
+		"""Copies of the arrays with the oldest sample first"""
+		end = self.start + self.size
+		def unroll(values: array) -> array:
+			return values[self.start:end] if end <= self.capacity else \
+				values[self.start:] + values[:end - self.capacity]
+		return unroll(self.times), unroll(self.players), unroll(self.opted_in)
+
+
+def downsample(samples: list[tuple[float, int, int]], points: int) -> list[tuple[float, int, int]]:
+	"""Reduces samples to at most points buckets, keeping each bucket's first time and peak counts"""
+	if len(samples) <= points:
+		return samples
+	size = len(samples) / points
+	buckets = []
+	for bucket in range(points):
+		chunk = samples[round(bucket * size):round((bucket + 1) * size)]
+		buckets.append((chunk[0][0], max(sample[1] for sample in chunk), max(sample[2] for sample in chunk)))
+	return buckets
+
+
+class History:
+	"""
+	Player count history for every server, sampled at a fixed interval. Saved to a compact binary file so it survives
+	restarts, only rewritten every save_interval seconds.
+	"""
+	header = Struct("<HI")  # Server id length, sample count
+
+	def __init__(self, servers, path: Path, *, capacity: int = 20160, save_interval: float = 600):
+		self.path = path
+		self.capacity = capacity
+		self.save_interval = save_interval
+		self.rings = {server: SampleRing(capacity) for server in servers}
+		self.last_saved = 0.
+		self.load()
+
+	def record(self, server: str, when: float, players: int, opted_in: int):
+		self.rings[server].append(when, players, opted_in)
+
+	def query(self, server: str, start: float, end: float, points: int = 0) -> list[tuple[float, int, int]]:
+		"""Samples for server between start and end, downsampled to at most points if given"""
+		samples = self.rings[server].range(start, end)
+		return downsample(samples, points) if points else samples
+
+	def dump(self) -> bytes:
+		out = bytearray()
+		for server, ring in self.rings.items():
+			encoded = server.encode()
+			out += self.header.pack(len(encoded), len(ring)) + encoded
+			for values in ring.ordered():
+				out += values.tobytes()
+		return bytes(out)
+
+	def load(self):
+		"""Loads saved samples for servers that are still tracked, keeping the newest if capacity shrank"""
+		try:
+			buf = memoryview(self.path.read_bytes())
+		except FileNotFoundError:
+			return
+		except OSError as err:
+			logging.error("Ignoring unreadable history %s | %s", self.path, err)
+			return
+
+		pos = 0
+		try:
+			while pos < len(buf):
+				id_length, count = self.header.unpack_from(buf, pos)
+				pos += self.header.size
+				server = bytes(buf[pos:pos + id_length]).decode()
+				pos += id_length
+				columns = []
+				for typecode in "dHH":
+					values = array(typecode)
+					values.frombytes(buf[pos:pos + values.itemsize * count])
+					if len(values) != count:
+						raise ValueError(f"{server} truncated to {len(values)} of {count} samples")
+					pos += values.itemsize * count
+					columns.append(values)
+				if server in self.rings:
+					for sample in zip(*(values[-self.capacity:] for values in columns)):
+						self.rings[server].append(*sample)
+		except (StructError, ValueError, UnicodeDecodeError) as err:
+			logging.error("Stopped loading history %s at byte %s, keeping servers before it | %s", self.path, pos, err)
+
+	def save(self, now: float, force: bool = False):
+		"""Rewrites the history file if save_interval has passed since it was last written"""
+		if force or now - self.last_saved >= self.save_interval:
+			write_atomic(self.path, self.dump())
+			self.last_saved = now
+
+
+# Fills weeks of samples for a few servers and checks memory, range queries and the saved file round trip, run with
+# tb_multiprocessing on the path as main.py sets it up
+if __name__ == "__main__":
+	from random import randint
+	from tempfile import TemporaryDirectory
+	from time import perf_counter
+	from tracemalloc import get_traced_memory, start
+
+	servers = ("gaw", "pgaw", "lkeu", "lkna")
+	interval = 120
+	weeks = 4
+	with TemporaryDirectory() as directory:
+		path = Path(directory) / "history.bin"
+		start()
+		history = History(servers, path, capacity=weeks * 7 * 24 * 3600 // interval)
+		for i in range(history.capacity + 1000):
+			for server in servers:
+				players = randint(0, 60)
+				history.record(server, i * interval, players, randint(0, players))
+		print(f"{history.capacity} samples x {len(servers)} servers | {get_traced_memory()[1] / 2 ** 20:.2f}MB peak")
+
+		latest = (history.capacity + 999) * interval
+		before = perf_counter()
+		for _ in range(1000):
+			day = history.query("gaw", latest - 86400, latest + 1)
+		print(f"Day query: {len(day)} samples in {(perf_counter() - before):.3f}ms, "
+			  f"downsampled to {len(history.query('gaw', 0, latest + 1, 120))} points")
+		print(len(history.query("gaw", 0, latest + 1)) == history.capacity, day[-1][0] == latest)
+
+		history.save(latest, force=True)
+		reloaded = History(servers, path, capacity=history.capacity)
+		print(f"Saved {path.stat().st_size / 2 ** 20:.2f}MB |",
+			  all(reloaded.query(server, 0, latest + 1) == history.query(server, 0, latest + 1) for server in servers))
@@ -1,15 +1,29 @@
+from codecs import getincrementaldecoder
 from datetime import datetime, timedelta
-from json import loads
-from re import match
-from typing import Literal
-from urllib.request import urlopen
+from http_session import session
+from json import JSONDecodeError, JSONDecoder
+from re import compile
+from typing import Iterable
 import logging
 
 
-def get_hoggit(server: Literal["gaw", "pgaw"]) -> dict:
-    with urlopen(f"https://statecache.hoggitworld.com/{server}", timeout=30) as pipe:
-        response = pipe.read().decode("utf-8")
-    data_dict = loads(response)
+AI_PILOT = compile(r"USA air \d+ unit\d")
+AIR_TYPES = {"Air+FixedWing", "Air+Rotorcraft"}
+KEPT_KEYS = {"objects", "players", "updateTime", "uptime", "metar"}
+NUMBER = compile(r"[-+.0-9eE]*")
+NUMBER_START = set("-0123456789")
+WHITESPACE = compile(r"[ \t\n\r]*")
+
+
+def get_hoggit(endpoint: str) -> dict | None:
+    """Returns processed server data, or None if the statecache at endpoint hasn't changed since the last call"""
+    if (chunks := session.stream(endpoint)) is None:
+        return None
+    data_dict = parse_statecache(chunks)
+    # The parser stops at the closing brace, the session only pools the connection and stores the ETag once the body
+    # has been read to the end
+    for _ in chunks:
+        pass
 
     # Check data to be processed for unexpected types
     if (type(data_dict["objects"]), type(data_dict["players"])) != (list, int) or data_dict["updateTime"] == "" \
@@ -18,12 +32,191 @@ def get_hoggit(server: Literal["gaw", "pgaw"]) -> dict:
         return {"exception": "Unexpected data types in server information"}
 
     seconds_to_restart = timedelta(seconds=14400 - data_dict["uptime"])
-    # List comprehension to end all list comprehensions (filters all except enemy air units with non-standard names)
-    players = [v["Pilot"] for v in data_dict["objects"] if
-               v["Coalition"] == "Enemies" and v["Type"] in {"Air+FixedWing", "Air+Rotorcraft"} and not match(
-                   r"USA air \d+ unit\d", v["Pilot"])]
+    restart_at = round((datetime.fromisoformat(data_dict['updateTime'][:-1]) + seconds_to_restart).timestamp())
 
     return {"player_count": f"{data_dict['players'] - 1} player(s) online",
-            "players": players,
+            "players": data_dict["objects"],
             "metar": f"METAR: `{data_dict['metar']}`",
-            "restart": f"restart <t:{round((datetime.fromisoformat(data_dict['updateTime'][:-1]) + seconds_to_restart).timestamp())}:R>"}
+            "restart": f"restart <t:{restart_at}:R>",
+            "_restart_at": restart_at,
+            "_player_count": data_dict['players'] - 1}
+
+
+def is_player(unit: dict) -> bool:
+    """Keeps enemy air units, except AI with standard names"""
+    return unit["Coalition"] == "Enemies" and unit["Type"] in AIR_TYPES and not AI_PILOT.match(unit["Pilot"])
+
+
+class StreamScanner:
+    """Parses JSON values one at a time from a stream of byte chunks, only holding unconsumed text in memory"""
+    decoder = JSONDecoder()
+
+    def __init__(self, chunks: Iterable[bytes]):
+        self.chunks = iter(chunks)
+        self.text_decoder = getincrementaldecoder("utf-8")()
+        self.buf = ""
+        self.pos = 0
+
+    def fill(self) -> bool:
+        """Drops consumed text and appends the next chunk, returns False at the end of the stream"""
+        if (chunk := next(self.chunks, None)) is None:
+            return False
+        self.buf = self.buf[self.pos:] + self.text_decoder.decode(chunk)
+        self.pos = 0
+        return True
+
+    def peek(self) -> str:
+        """Skips whitespace and returns the next character without consuming it"""
+        while True:
+            self.pos = WHITESPACE.match(self.buf, self.pos).end()
+            if self.pos < len(self.buf):
+                return self.buf[self.pos]
+            if not self.fill():
+                raise ValueError("Unexpected end of statecache")
+
+    def expect(self, char: str):
+        if (found := self.peek()) != char:
+            raise ValueError(f"Expected {char!r} in statecache, found {found!r}")
+        self.pos += 1
+
+    def value(self):
+        """Parses the next complete JSON value"""
+        while True:
+            # A number running to the end of the buffer may continue in the next chunk
+            if self.peek() in NUMBER_START and NUMBER.match(self.buf, self.pos).end() == len(self.buf) and self.fill():
+                continue
+            try:
+                value, self.pos = self.decoder.raw_decode(self.buf, self.pos)
+            except JSONDecodeError:
+                if self.fill():
+                    continue
+                raise
+            return value
+
+
+def parse_statecache(chunks: Iterable[bytes]) -> dict:
+    """
+    Parses a statecache as it streams in. Top level keys other than KEPT_KEYS are discarded, and "objects" is filtered
+    row by row into the list of player pilot names, so the full objects array is never held in memory.
+    """
+    scanner = StreamScanner(chunks)
+    out = {}
+    scanner.expect("{")
+    if scanner.peek() == "}":
+        return out
+
+    while True:
+        key = scanner.value()
+        scanner.expect(":")
+        if key == "objects" and scanner.peek() == "[":
+            scanner.pos += 1
+            players = []
+            if scanner.peek() != "]":
+                while True:
+                    unit = scanner.value()
+                    if is_player(unit):
+                        players.append(unit["Pilot"])
+                    if scanner.peek() != ",":
+                        break
+                    scanner.pos += 1
+            scanner.expect("]")
+            out[key] = players
+        elif key in KEPT_KEYS:
+            out[key] = scanner.value()
+        else:
+            scanner.value()
+
+        if scanner.peek() == "}":
+            return out
+        scanner.expect(",")
+
+
+# Benchmark against parsing the whole statecache at once, on a generated statecache shaped like a busy server's
+if __name__ == "__main__":
+    from gzip import compress
+    from io import BytesIO
+    from json import dumps, loads
+    from random import choice, randint, seed
+    from re import match
+    from time import perf_counter
+    import http_session
+    import tracemalloc
+
+    def generate_statecache(unit_count: int) -> bytes:
+        seed(0)
+        objects = []
+        for i in range(unit_count):
+            unit_type = choice(["Air+FixedWing", "Air+Rotorcraft", "Ground+Tracked", "Ground+Wheeled", "Sea+Watercraft"])
+            pilot = choice([f"USA air {randint(1, 99)} unit{randint(1, 4)}", f"Player {i}", f"Unit #{i}"])
+            objects.append({"Coalition": choice(["Enemies", "Allies"]), "Type": unit_type, "Pilot": pilot,
+                            "Name": f"Unit {i}", "Group": f"Group {i // 4}", "Country": randint(0, 80),
+                            "LatLongAlt": {"Lat": 42.1 + i / 1e5, "Long": 41.6 + i / 1e5, "Alt": randint(0, 9000)},
+                            "Heading": randint(0, 359) / 57.3, "Flags": {"Born": True, "AI_ON": True, "Human": False}})
+        return dumps({"players": 60, "objects": objects, "updateTime": "2023-05-01T12:00:00Z", "uptime": 3600.5,
+                      "metar": "UGKO 011200Z 27005KT 9999 SCT030 15/10 Q1015", "missionName": "GAW"}).encode()
+
+    def whole_parse(body: bytes) -> list[str]:
+        data_dict = loads(body.decode("utf-8"))
+        return [v["Pilot"] for v in data_dict["objects"] if
+                v["Coalition"] == "Enemies" and v["Type"] in {"Air+FixedWing", "Air+Rotorcraft"} and not match(
+                    r"USA air \d+ unit\d", v["Pilot"])]
+
+    def stream_parse(body: bytes) -> list[str]:
+        view = memoryview(body)
+        return parse_statecache(bytes(view[i:i + 65536]) for i in range(0, len(body), 65536))["objects"]
+
+    def measure(parse, body: bytes) -> tuple[list[str], float, int]:
+        tracemalloc.start()
+        start = perf_counter()
+        result = parse(body)
+        elapsed = perf_counter() - start
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        return result, elapsed, peak
+
+    class FakeResponse:
+        """Serves body once with an ETag, then 304 to requests that send it back"""
+        def __init__(self, body: bytes, headers: dict[str, str]):
+            self.body = BytesIO(body)
+            self.headers = headers
+            self.status, self.reason = (304, "Not Modified") if not body else (200, "OK")
+            self.will_close = False
+
+        def read(self, amt: int = -1) -> bytes:
+            return self.body.read(amt)
+
+        def getheader(self, name: str) -> str | None:
+            return self.headers.get(name)
+
+    class FakeConnection:
+        def __init__(self, host: str, timeout: float):
+            self.sent: list[dict[str, str]] = []
+            self.closed = False
+
+        def request(self, method: str, target: str, headers: dict[str, str]):
+            self.sent.append(headers)
+
+        def getresponse(self) -> FakeResponse:
+            if self.sent[-1].get("If-None-Match") == '"v1"':
+                return FakeResponse(b"", {})
+            return FakeResponse(compress(generate_statecache(100)), {"Content-Encoding": "gzip", "ETag": '"v1"'})
+
+        def close(self):
+            self.closed = True
+
+    # A second poll of an unchanged statecache must be a conditional request on the same connection
+    http_session.HTTPSConnection = FakeConnection
+    assert get_hoggit("https://statecache.example/gaw") is not None
+    assert get_hoggit("https://statecache.example/gaw") is None, "second poll wasn't answered with a 304"
+    conn = session.idle["statecache.example"][0]
+    assert conn.sent[1]["If-None-Match"] == '"v1"' and not conn.closed and session.connections == 1
+    print(session.stats())
+
+    for unit_count in (1000, 10000, 50000):
+        body = generate_statecache(unit_count)
+        whole_players, whole_time, whole_peak = measure(whole_parse, body)
+        stream_players, stream_time, stream_peak = measure(stream_parse, body)
+        assert whole_players == stream_players
+        print(f"{unit_count} units, {len(body) / 1e6:.1f}MB, {len(whole_players)} players | "
+              f"whole: {whole_time * 1000:.0f}ms, peak {whole_peak / 1e6:.1f}MB | "
+              f"streaming: {stream_time * 1000:.0f}ms, peak {stream_peak / 1e6:.2f}MB")
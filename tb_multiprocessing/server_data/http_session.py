@@ -0,0 +1,132 @@
+"""Shared keep-alive HTTPS connections with conditional, compressed requests for the server_data sources"""
+from http.client import HTTPException, HTTPResponse, HTTPSConnection
+from threading import Lock
+from typing import Iterator
+from urllib.parse import urlsplit
+from zlib import decompressobj, MAX_WBITS
+
+__all__ = ["HTTPSession", "session"]
+
+
+class HTTPSession:
+	"""
+	Reuses idle connections per host and remembers ETag/Last-Modified per url, so an unchanged resource costs a
+	304 on an already open connection. Safe to share between the poller's worker threads.
+	"""
+	def __init__(self, timeout: float = 30):
+		self.timeout = timeout
+		self.lock = Lock()
+		self.idle: dict[str, list[HTTPSConnection]] = {}
+		self.validators: dict[str, tuple[str | None, str | None]] = {}
+		self.hits = 0           # 304 responses
+		self.misses = 0         # Full responses
+		self.connections = 0    # Connections opened
+
+	def _checkout(self, host: str) -> tuple[HTTPSConnection, bool]:
+		"""Returns an idle connection to host if there is one, or a new one, and whether it was reused"""
+		with self.lock:
+			if idle := self.idle.get(host):
+				return idle.pop(), True
+		return self._connect(host), False
+
+	def _connect(self, host: str) -> HTTPSConnection:
+		with self.lock:
+			self.connections += 1
+		return HTTPSConnection(host, timeout=self.timeout)
+
+	def _checkin(self, host: str, conn: HTTPSConnection):
+		with self.lock:
+			self.idle.setdefault(host, []).append(conn)
+
+	def get(self, url: str) -> bytes | None:
+		"""
+		Gets url, returning None if it hasn't changed since the last successful get
+		Raises:
+			HTTPException | The server responded with anything other than 200 or 304
+		"""
+		if (chunks := self.stream(url)) is None:
+			return None
+		return b"".join(chunks)
+
+	def stream(self, url: str, chunk_size: int = 65536) -> Iterator[bytes] | None:
+		"""
+		Gets url as an iterator of decompressed body chunks, returning None if it hasn't changed since the last
+		successful get. The connection goes back to the pool once the iterator is exhausted.
+		Raises:
+			HTTPException | The server responded with anything other than 200 or 304
+		"""
+		parts = urlsplit(url)
+		target = parts.path + (f"?{parts.query}" if parts.query else "")
+		headers = {"Accept-Encoding": "gzip"}
+		with self.lock:
+			etag, last_modified = self.validators.get(url, (None, None))
+		if etag:
+			headers["If-None-Match"] = etag
+		if last_modified:
+			headers["If-Modified-Since"] = last_modified
+
+		conn, reused = self._checkout(parts.netloc)
+		try:
+			try:
+				conn.request("GET", target, headers=headers)
+				response = conn.getresponse()
+			except (HTTPException, OSError):
+				if not reused:
+					raise
+				# The server may have dropped the idle connection, retry once on a fresh one
+				conn.close()
+				conn = self._connect(parts.netloc)
+				conn.request("GET", target, headers=headers)
+				response = conn.getresponse()
+
+			if response.status != 200:
+				response.read()
+		except BaseException:
+			conn.close()
+			raise
+
+		if response.status != 200:
+			self._release(parts.netloc, conn, response)
+			if response.status == 304:
+				with self.lock:
+					self.hits += 1
+				return None
+			raise HTTPException(f"{url} responded with {response.status} {response.reason}")
+
+		with self.lock:
+			self.misses += 1
+		return self._body(url, parts.netloc, conn, response, chunk_size)
+
+	def _body(self, url: str, host: str, conn: HTTPSConnection, response: HTTPResponse,
+			  chunk_size: int) -> Iterator[bytes]:
+		"""Yields the body of a 200 response, only remembering its validators once it has been read in full"""
+		decompressor = decompressobj(MAX_WBITS | 16) if response.getheader("Content-Encoding") == "gzip" else None
+		complete = False
+		try:
+			while chunk := response.read(chunk_size):
+				yield decompressor.decompress(chunk) if decompressor else chunk
+			if decompressor:
+				yield decompressor.flush()
+			complete = True
+		finally:
+			if complete:
+				self._release(host, conn, response)
+			else:
+				conn.close()
+
+		with self.lock:
+			self.validators[url] = (response.getheader("ETag"), response.getheader("Last-Modified"))
+
+	def _release(self, host: str, conn: HTTPSConnection, response: HTTPResponse):
+		"""Returns conn to the pool after its response has been read, unless the server is closing it"""
+		if response.will_close:
+			conn.close()
+		else:
+			self._checkin(host, conn)
+
+	def stats(self) -> str:
+		with self.lock:
+			return f"HTTP cache hits: {self.hits}, misses: {self.misses}, connections opened: {self.connections}"
+
+
+session = HTTPSession()
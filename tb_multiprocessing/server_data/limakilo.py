@@ -1,21 +1,23 @@
 from datetime import datetime, timedelta
+from http_session import session
 from json import loads
-from typing import Literal
-from urllib.request import urlopen
 
 from discord.utils import format_dt as dt
 
 
-def get_lk(server: Literal["eu", "na"]) -> dict:
-	with urlopen(f"https://levant.{server}.limakilo.net/status/data", timeout=30) as pipe:
-		response = pipe.read().decode("utf-8")
+def get_lk(endpoint: str) -> dict | None:
+	"""Returns processed server data, or None if the status at endpoint hasn't changed since the last call"""
+	if (response := session.get(endpoint)) is None:
+		return None
 	data_dict = loads(response)
 
 	if data_dict is None:
 		return {"exception": "Server offline"}
 
 	seconds_to_restart = timedelta(seconds=int(data_dict["restartPeriod"]) - int(data_dict["modelTime"]))
-	restart_time = dt((datetime.fromisoformat(data_dict['date'][:-1]) + seconds_to_restart), style="R")
+	restart_at = datetime.fromisoformat(data_dict['date'][:-1]) + seconds_to_restart
 	return {"player_count": f"{int(data_dict['players']['current']) - 1} player(s) online",
 			"players": [i["name"] for i in data_dict["players"]['list']],
-			"restart": f"restart {restart_time}"}
+			"restart": f"restart {dt(restart_at, style='R')}",
+			"_restart_at": round(restart_at.timestamp()),
+			"_player_count": int(data_dict['players']['current']) - 1}
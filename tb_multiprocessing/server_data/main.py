@@ -1,21 +1,35 @@
 """Creates multiprocessing processes for server_data with minimal dependencies"""
-from comm_checker import check_usernames
+from pathlib import Path
+from sys import path
+
+# Path hack, but I"d otherwise have to make this subprocess above the main in the directory structure. Runs before the
+# sibling imports below as history imports io_utils from there.
+path.append(str(Path(__file__).parent.parent))
+
+from comm_checker import check_usernames, comms_dict, label_players, log_user, warm_cache
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
 from hoggit import get_hoggit
+from history import History
+from http_session import session
 from limakilo import get_lk
-from pathlib import Path
+from presence import PresenceIndex
+from scheduler import SourceSchedule
 from signal import signal, SIGINT
-from sys import path
+from threading import Lock, Thread
 from time import gmtime, sleep, time
+from typing import Callable
 import logging
 import socket
 
-# Path hack, but I"d otherwise have to make this subprocess above the main in the directory structure.
-path.append(str(Path(__file__).parent.parent))
-
-from io_utils import network_encode, SocketHandler
+from configs import configs, ServerSource
+from db_stats import query_origin
+from tb_db import pool as db_pool, query_stats
+from io_utils import ACK_FRAME, HEARTBEAT_FRAME, load_snapshot, network_decode, network_encode, RESTORED_KEY, \
+	RPC_FRAME, write_atomic, SocketHandler
 
 
 logging.basicConfig(filename=Path(__file__).parent / "runtime.log", encoding="utf-8", level=logging.INFO)
+db_pool.resize(configs.poller_db_pool_size)
 
 
 # =======INTERRUPT HANDLER=======
@@ -23,6 +37,10 @@ logging.basicConfig(filename=Path(__file__).parent / "runtime.log", encoding="ut
 
 def interrupt_handler(signum, frame):
 	print("Closing subprocess")
+	try:
+		history.save(time(), force=True)
+	except (NameError, OSError) as err:   # NameError if interrupted before history was loaded
+		logging.error("%s | Failed to save history on close\n%s", gmtime(time()), err)
 	sock.close()
 	exit()
 
@@ -35,29 +53,267 @@ signal(SIGINT, interrupt_handler)
 
 sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
 sock.connect(("localhost", 20250))
-connection = SocketHandler(sock, recieving=False)
+connection = SocketHandler(sock)
 
 
-# =======MAIN LOOP=======
+# =======FETCHING=======
 
-data = [{"exception": "Getting data from server failed"}, {"exception": "Getting data from server failed"},
-		{"exception": "Getting data from server failed"}, {"exception": "Getting data from server failed"}]
-while True:
-	start = time()
-	for server, ind in (("gaw", 0), ("pgaw", 1), ("lkeu", 2), ("lkna", 3)):
+
+SOURCE_TIMEOUT = 45     # Seconds a source has to respond before it is counted as failed
+STATS_INTERVAL = 3600   # Seconds between logging HTTP cache statistics
+CACHE_REFRESH = 600     # Seconds between reloading the opt in/out cache from the database
+HEARTBEAT_INTERVAL = 10 # Seconds between heartbeats, the main process restarts this one if they stop
+SNAPSHOT_PATH = Path(__file__).parent / "snapshot.bin"  # Last sent data, loaded on start by both processes
+SAMPLE_INTERVAL = 120   # Seconds between player count history samples
+HISTORY_DAYS = 28       # Days of history kept per server
+
+getters: dict[str, Callable[[str], dict | None]] = {"hoggit": get_hoggit, "limakilo": get_lk}
+sources: dict[str, ServerSource] = {source.id: source for source in configs.servers}
+schedules = {source.id: SourceSchedule(source.interval) for source in configs.servers}
+workers = max(1, min(len(sources), configs.poller_workers))
+pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="server_data")
+in_flight: dict[str, tuple[Future, float]] = {}     # Source id: (future, time submitted)
+timed_out: set[str] = set()
+
+
+def fetch(source: ServerSource) -> tuple[dict, dict] | None:
+	"""
+	Returns processed data and its private keys (ex. _restart_at) split off, or None if the source hasn't changed,
+	skipping the opt in lookup entirely
+	"""
+	query_origin.set(f"poller:{source.id}")
+	if (result := getters[source.kind](source.endpoint)) is None:
+		return None
+	private = {key: result.pop(key) for key in [key for key in result if key.startswith("_")]}
+	return check_usernames(result), private
+
+
+def poll(data: dict[str, dict], deadline: float) -> bool:
+	"""
+	Submits due sources to free workers, then waits until a fetch completes, times out, another source is due, or
+	deadline passes, and updates data in place with completed fetches. A source is never submitted again while it is
+	still in flight.
+	Returns:
+		bool | Whether data changed
+	"""
+	now = time()
+	# Most overdue first, only as many as there are free workers so queued fetches never count towards the timeout
+	due = sorted((schedule.next_due, server) for server, schedule in schedules.items()
+				 if server not in in_flight and schedule.due(now))
+	for _, server in due[:workers - len(in_flight)]:
+		in_flight[server] = (pool.submit(fetch, sources[server]), now)
+
+	wake_times = []
+	if len(in_flight) < workers:
+		wake_times += [schedule.next_due for server, schedule in schedules.items() if server not in in_flight]
+	wake_times += [submitted + SOURCE_TIMEOUT for server, (_, submitted) in in_flight.items() if server not in timed_out]
+	timeout = max(0., min(wake_times + [deadline]) - now)
+	if in_flight:
+		done, _ = wait([future for future, _ in in_flight.values()], timeout=timeout, return_when=FIRST_COMPLETED)
+	else:
+		# wait returns immediately without any futures
+		sleep(timeout)
+		return False
+
+	now = time()
+	changed = False
+	for server, (future, submitted) in tuple(in_flight.items()):
+		if future not in done:
+			if now - submitted >= SOURCE_TIMEOUT and server not in timed_out:
+				logging.error("%s | Getting data from %s has taken over %s seconds", gmtime(now), server, SOURCE_TIMEOUT)
+				timed_out.add(server)
+				schedules[server].failed(now)
+			continue
+
+		del in_flight[server]
+		timed_out.discard(server)
+		try:
+			result = future.result()
+		except Exception as err:
+			logging.error("%s | Exception in getting data from %s\n%s", gmtime(now), server, err)
+			schedules[server].failed(now)
+			continue
+
+		if result is None:
+			# Unchanged, so an offline server (ex. limakilo serving null with an ETag) stays backed off
+			with data_lock:
+				offline = "exception" in data[server]
+			if offline:
+				schedules[server].failed(now)
+				continue
+			schedules[server].succeeded(now)
+			with presence_lock:
+				presence.touch(server, now)
+			continue
+		with data_lock:
+			data[server], private = result
+			restored.pop(server, None)
+		player_counts[server] = private.get("_player_count")
+		changed = True
+		if "exception" in data[server]:
+			schedules[server].failed(now)
+			# Its players can't be seen any more, they're marked as leaving when the server was last known to be up
+			with presence_lock:
+				presence.update(server, [], now)
+		else:
+			schedules[server].succeeded(now, private.get("_restart_at"))
+			with presence_lock:
+				presence.update(server, [username for username, _ in data[server].get("players", ())], now)
+	return changed
+
+
+# =======REMOTE PROCEDURE CALLS=======
+
+
+data_lock = Lock()  # Held while data is changed or encoded, RPCs change it from the listener thread
+send_lock = Lock()  # Held from encoding data until it is sent and saved, so frames go out in the order they're encoded
+
+
+def send_heartbeat():
+	connection.write(network_encode(time()), HEARTBEAT_FRAME)
+
+
+def send_data():
+	"""Sends data to the main process and saves it as the snapshot, called from both the main loop and RPCs"""
+	with send_lock:
+		with data_lock:
+			msg = network_encode({**data, RESTORED_KEY: restored} if restored else data)
+		connection.write(msg)
+		try:
+			write_atomic(SNAPSHOT_PATH, msg)
+		except OSError as err:
+			logging.error("%s | Failed to save snapshot\n%s", gmtime(time()), err)
+
+
+def relabel_players() -> bool:
+	"""Re-applies cached opt in/out states to every server's players, returns whether any state changed"""
+	changed = False
+	with data_lock:
+		for server_info in data.values():
+			if "players" in server_info:
+				labelled = label_players([uname for uname, _ in server_info["players"]])
+				changed = changed or labelled != server_info["players"]
+				server_info["players"] = labelled
+	return changed
+
+
+def rpc_log_user(username: str, state: bool) -> bool:
+	"""Writes through to the database and cache, then sends the change straight away"""
+	log_user(username, state)
+	if relabel_players():
+		send_data()
+	return state
+
+
+def rpc_history(server: str, start: float, end: float, points: int) -> list[tuple[float, int, int]]:
+	"""(time, players, opted in) samples for server between start and end, at most points of them"""
+	with history_lock:
+		return history.query(server, start, end, points)
+
+
+def rpc_whereis(query: str, limit: int) -> list[tuple[str, str, float, float, bool]]:
+	"""(username, server, first seen, last seen, online) for an exact username, or up to limit prefix matches"""
+	with presence_lock:
+		return presence.find(query, limit)
+
+
+rpc_methods = {"history": rpc_history, "log_user": rpc_log_user, "whereis": rpc_whereis}
+
+
+def rpc_listener():
+	"""Answers every RPC frame from the main process with an ack frame, runs on its own thread"""
+	while True:
+		try:
+			kind, body = connection.read()
+		except OSError as err:
+			logging.error("%s | Lost connection to main process\n%s", gmtime(time()), err)
+			return
+		if kind != RPC_FRAME:
+			logging.warning("%s | Discarding frame of unexpected type %s", gmtime(time()), kind)
+			continue
+
+		try:
+			request_id, method, args = network_decode(body)
+		except Exception as err:
+			# Without a request id there's nothing to reply to, the caller times out
+			logging.error("%s | Discarding undecodable RPC frame\n%s", gmtime(time()), err)
+			continue
+		query_origin.set(f"poller:rpc:{method}")
 		try:
-			match server:
-				case "gaw":
-					data[ind] = check_usernames(get_hoggit("gaw"))
-				case "pgaw":
-					data[ind] = check_usernames(get_hoggit("pgaw"))
-				case "lkeu":
-					data[ind] = check_usernames(get_lk("eu"))
-				case "lkna":
-					data[ind] = check_usernames(get_lk("na"))
+			reply = (request_id, True, rpc_methods[method](*args))
 		except Exception as err:
-			logging.error("%s | Exception in getting data from %s\n%s", gmtime(time()), server, err)
-	connection.write(network_encode(data))
-	sleep(120 - time() + start)
+			logging.error("%s | Exception in RPC %s%s\n%s", gmtime(time()), method, args, err)
+			reply = (request_id, False, f"{type(err).__name__}: {err}")
+		connection.write(network_encode(reply), ACK_FRAME)
 
 
+# =======HISTORY=======
+
+
+history = History(sources, Path(__file__).parent / "history.bin",
+				  capacity=HISTORY_DAYS * 86400 // SAMPLE_INTERVAL)
+history_lock = Lock()   # RPCs query history from the listener thread
+player_counts: dict[str, int | None] = {}  # Source id: player count from its last successful fetch
+
+
+def sample(now: float):
+	"""Records every server with data from this run, opted in players counted from their current labels"""
+	opted_in_label = comms_dict[1]
+	with data_lock:
+		counts = {server: (players, sum(state == opted_in_label for _, state in data[server].get("players", ())))
+				  for server, players in player_counts.items() if players is not None and "exception" not in data[server]}
+	with history_lock:
+		for server, (players, opted_in) in counts.items():
+			try:
+				history.record(server, now, players, opted_in)
+			except (OverflowError, TypeError, ValueError) as err:
+				logging.error("%s | Failed to record history for %s\n%s", gmtime(now), server, err)
+		try:
+			history.save(now)
+		except OSError as err:
+			logging.error("%s | Failed to save history\n%s", gmtime(now), err)
+
+
+# =======PRESENCE=======
+
+
+presence = PresenceIndex()
+presence_lock = Lock()  # RPCs search presence from the listener thread
+
+
+# =======MAIN LOOP=======
+
+# Start from the last saved data, marked as restored until each source is polled again
+saved = load_snapshot(SNAPSHOT_PATH) or {RESTORED_KEY: {}}
+data = {server: saved.get(server, {"exception": "Getting data from server failed"}) for server in sources}
+restored: dict[str, float] = {server: saved_at for server, saved_at in saved[RESTORED_KEY].items() if server in sources}
+Thread(target=rpc_listener, name="rpc_listener", daemon=True).start()
+last_stats = time()
+last_warm = 0.
+last_heartbeat = 0.
+last_sample = time()
+while True:
+	if time() - last_heartbeat >= HEARTBEAT_INTERVAL:
+		last_heartbeat = time()
+		send_heartbeat()
+	if time() - last_warm >= CACHE_REFRESH:
+		last_warm = time()
+		query_origin.set("poller:warm_cache")
+		try:
+			warm_cache()
+		except Exception as err:
+			logging.error("%s | Exception in loading opt in/out cache\n%s", gmtime(time()), err)
+		else:
+			if relabel_players():
+				send_data()
+	if poll(data, min(last_heartbeat + HEARTBEAT_INTERVAL, last_sample + SAMPLE_INTERVAL)):
+		send_data()
+	if time() - last_sample >= SAMPLE_INTERVAL:
+		last_sample = time()
+		sample(last_sample)
+		with presence_lock:
+			presence.prune(last_sample)
+	if time() - last_stats >= STATS_INTERVAL:
+		logging.info("%s | %s | Database pool: %s\n%s", gmtime(time()), session.stats(), db_pool.stats(),
+					 query_stats.summary())
+		last_stats = time()
@@ -0,0 +1,71 @@
+"""Cross-server index of where each player is or was last seen for the server_data process"""
+from bisect import bisect_left, insort
+from comm_checker import username_key
+
+__all__ = ["PresenceIndex"]
+
+
+class PresenceIndex:
+	"""
+	Maps each player's username key to the servers they have been seen on, as [username, first_seen, last_seen] with
+	last_seen None while they're still online. Only players who joined or left are touched on each update, and a
+	sorted list of keys serves prefix searches by bisection.
+	"""
+	def __init__(self, retention: float = 7 * 86400):
+		self.retention = retention  # Seconds offline players are kept for
+		self.entries: dict[str, dict[str, list]] = {}
+		self.keys: list[str] = []   # Sorted keys of entries
+		self.online: dict[str, set[str]] = {}
+		self.updated: dict[str, float] = {}     # Server: time its player list was last known to be current
+
+	def update(self, server: str, usernames: list[str], now: float):
+		"""Applies a server's current player list, only joins and leaves since its last list are processed"""
+		names = {username_key(username): username for username in usernames}
+		current = set(names)
+		previous = self.online.get(server, set())
+		for key in current - previous:
+			if (servers := self.entries.get(key)) is None:
+				servers = self.entries[key] = {}
+				insort(self.keys, key)
+			servers[server] = [names[key], now, None]
+		for key in previous - current:
+			self.entries[key][server][2] = self.updated.get(server, now)
+		self.online[server] = current
+		self.updated[server] = now
+
+	def touch(self, server: str, now: float):
+		"""Marks a server's player list as current when it is known to be unchanged"""
+		if server in self.online:
+			self.updated[server] = now
+
+	def _seen(self, key: str) -> list[tuple[str, str, float, float, bool]]:
+		"""(username, server, first seen, last seen, online) for every server key was seen on, most recent first"""
+		seen = [(username, server, first, self.updated[server] if last is None else last, last is None)
+				for server, (username, first, last) in self.entries[key].items()]
+		return sorted(seen, key=lambda entry: (entry[4], entry[3]), reverse=True)
+
+	def find(self, query: str, limit: int = 10) -> list[tuple[str, str, float, float, bool]]:
+		"""An exact username match, or else up to limit players whose username starts with query"""
+		key = username_key(query)
+		if key in self.entries:
+			return self._seen(key)
+		results = []
+		i = bisect_left(self.keys, key)
+		while i < len(self.keys) and self.keys[i].startswith(key) and len(results) < limit:
+			results.append(self._seen(self.keys[i])[0])
+			i += 1
+		return results
+
+	def prune(self, now: float):
+		"""Forgets appearances that ended over retention seconds ago, and players with none left"""
+		emptied = set()
+		for key, servers in self.entries.items():
+			for server in [server for server, (_, _, last) in servers.items() if last is not None and
+						   now - last > self.retention]:
+				del servers[server]
+			if not servers:
+				emptied.add(key)
+		if emptied:
+			for key in emptied:
+				del self.entries[key]
+			self.keys = [key for key in self.keys if key not in emptied]
@@ -0,0 +1,52 @@
+"""Per-source polling schedule for the server_data process"""
+from random import uniform
+
+__all__ = ["SourceSchedule"]
+
+
+class SourceSchedule:
+	"""
+	Tracks when a single source is next due. Healthy sources are polled every interval (with a little jitter so sources
+	sharing a host drift apart), failing or offline sources back off exponentially with full jitter up to max_backoff,
+	and sources past their predicted restart are polled every restart_interval for restart_window seconds to pick the
+	new mission up quickly.
+	"""
+	def __init__(self, interval: float, *, max_backoff: float = 1800, restart_interval: float = 30,
+				 restart_window: float = 300):
+		self.interval = interval
+		self.max_backoff = max_backoff
+		self.restart_interval = restart_interval
+		self.restart_window = restart_window
+		self.failures = 0
+		self.restart_at = None
+		self.next_due = 0.
+
+	def due(self, now: float) -> bool:
+		return self.next_due <= now
+
+	def succeeded(self, now: float, restart_at: float | None = None):
+		"""Schedules the next poll after a successful one, restart_at is the predicted restart epoch if known"""
+		self.failures = 0
+		if restart_at is not None:
+			self.restart_at = restart_at
+		self.next_due = now + self._delay(now)
+
+	def failed(self, now: float):
+		"""Schedules the next poll after an error, timeout or offline server"""
+		self.failures += 1
+		backoff = min(self.max_backoff, self.interval * 2 ** (self.failures - 1))
+		self.next_due = now + max(self.restart_interval, uniform(0, backoff))
+
+	def _delay(self, now: float) -> float:
+		delay = self.interval * uniform(0.9, 1.1)
+		if self.restart_at is None:
+			return delay
+
+		until_restart = self.restart_at - now
+		if -self.restart_window <= until_restart <= 0:
+			# Should have restarted recently, poll quickly until the new mission shows up
+			return min(delay, self.restart_interval)
+		if 0 < until_restart < delay:
+			# Restart falls before the next regular poll, poll just after it instead
+			return until_restart + self.restart_interval
+		return delay
@@ -0,0 +1,219 @@
+"""Supervises a child process connected over a localhost socket, restarting it if it dies or goes quiet"""
+from asyncio import get_running_loop, sleep, Task, to_thread, wait_for
+from random import uniform
+from subprocess import Popen
+from time import time
+from typing import Awaitable, Callable
+import logging
+import socket
+
+
+class Supervisor:
+	"""
+	Runs command as a child process which connects back to sock. Whenever the child exits, or nothing has been heard
+	from it for heartbeat_timeout seconds, it is killed and restarted after an exponential backoff and attach is
+	called with the new connection. Whatever receives frames from the child must call beat for every frame.
+	"""
+	def __init__(self, command: list, sock: socket.socket, *, name: str = "Child process", heartbeat_timeout: float = 45,
+				 check_interval: float = 5, max_backoff: float = 300, accept_timeout: float = 60):
+		self.command = command
+		self.name = name
+		self.sock = sock
+		self.heartbeat_timeout = heartbeat_timeout
+		self.check_interval = check_interval
+		self.max_backoff = max_backoff
+		self.accept_timeout = accept_timeout
+
+		self.process: Popen | None = None
+		self.conn: socket.socket | None = None
+		self.attach: Callable[[socket.socket], Awaitable] | None = None
+		self.task: Task | None = None
+		self.last_frame = time()
+		self.connected_at = time()
+		self.handshake_time: float | None = None    # Seconds from spawning the child to it connecting, last spawn
+		self.failures = 0   # Consecutive restarts without the child staying healthy
+		self.restarts = 0
+
+	async def start(self, attach: Callable[[socket.socket], Awaitable]):
+		"""
+		Spawns the child, attaches its connection and starts watching it, without ever blocking the event loop. If the
+		first child fails to connect the watcher restarts it like any other stalled child.
+		"""
+		self.attach = attach
+		self.sock.setblocking(False)
+		try:
+			await self._spawn()
+		except Exception as err:
+			logging.error("Failed to start %s | %s", self.name, err)
+		self.task = get_running_loop().create_task(self._watch())
+
+	def _discard_pending(self):
+		"""
+		Closes connections queued on sock by children since killed, ex. one that connected after its accept timed out,
+		which would otherwise be accepted in place of the next child's
+		"""
+		while True:
+			try:
+				conn, _ = self.sock.accept()
+			except (BlockingIOError, InterruptedError):
+				return
+			logging.warning("Discarding connection left by a previous %s", self.name)
+			conn.close()
+
+	async def _spawn(self):
+		"""Starts the child and attaches its connection once it connects back"""
+		self._discard_pending()
+		spawned_at = self.last_frame = time()
+		self.process = await to_thread(Popen, self.command)
+		try:
+			self.conn, _ = await wait_for(get_running_loop().sock_accept(self.sock), self.accept_timeout)
+		except TimeoutError:
+			logging.error("%s did not connect within %s seconds", self.name, self.accept_timeout)
+			return
+		self.connected_at = self.last_frame = time()
+		self.handshake_time = self.connected_at - spawned_at
+		logging.info("%s connected %.2f seconds after spawning", self.name, self.handshake_time)
+		await self.attach(self.conn)
+
+	def beat(self):
+		self.last_frame = time()
+
+	@property
+	def silent_for(self) -> float:
+		"""Seconds since anything was last received from the child"""
+		return time() - self.last_frame
+
+	@property
+	def stalled(self) -> bool:
+		return self.silent_for > self.heartbeat_timeout
+
+	async def _watch(self):
+		while True:
+			await sleep(self.check_interval)
+			if self.process is None:
+				reason = "never started"
+			elif (code := self.process.poll()) is not None:
+				reason = f"exited with code {code}"
+			elif self.stalled:
+				reason = f"sent nothing for {round(self.silent_for)} seconds"
+			else:
+				if self.failures and time() - self.connected_at > self.heartbeat_timeout * 2:
+					self.failures = 0
+				continue
+
+			logging.error("%s %s, restarting", self.name, reason)
+			try:
+				await self._restart()
+			except Exception as err:
+				logging.error("Failed to restart %s | %s", self.name, err)
+
+	async def _restart(self):
+		if self.process is not None and self.process.poll() is None:
+			self.process.kill()
+			await to_thread(self.process.wait)
+
+		backoff = min(self.max_backoff, 2 ** self.failures)
+		self.failures += 1
+		await sleep(uniform(backoff / 2, backoff))
+
+		self.restarts += 1
+		await self._spawn()
+
+	def stop(self, sig: int):
+		if self.task:
+			self.task.cancel()
+		if self.process and self.process.poll() is None:
+			self.process.send_signal(sig)
+		self.sock.close()
+
+
+# Soak test, kills and stalls a stand-in child repeatedly and checks the event loop never stalls, then checks a child
+# connecting after its accept timed out doesn't leave a connection the next child's is mistaken for
+if __name__ == "__main__":
+	from asyncio import run
+	from io_utils import FrameProtocol
+	from pathlib import Path
+	from signal import SIGKILL
+	from sys import executable, path
+
+	path.append(str(Path(__file__).parent.parent))
+	from loop_lag import max_lag_during
+
+	CHILD = """
+import random, socket, sys, time
+sock = socket.create_connection(("localhost", int(sys.argv[1])))
+deadline = time.time() + random.uniform(0.5, 3)
+while time.time() < deadline:
+	sock.sendall((2).to_bytes(3, "big") + bytes((3, 2)))
+	time.sleep(0.1)
+if random.random() < 0.5:
+	time.sleep(60)	# Stall without exiting
+"""
+	LATE_CHILD = """
+import socket, sys, time
+time.sleep(float(sys.argv[2]))
+sock = socket.create_connection(("localhost", int(sys.argv[1])))
+while True:
+	sock.sendall((2).to_bytes(3, "big") + bytes((3, 2)))
+	time.sleep(0.1)
+"""
+
+	def supervised(child: str, *args: str, heartbeat_timeout: float = 1,
+				   accept_timeout: float = 5) -> tuple[Supervisor, Callable, list[int]]:
+		"""Supervisor for child on a free port, with an attach callback counting frames received into frames[0]"""
+		sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+		sock.bind(("localhost", 0))
+		sock.listen(1)
+		supervisor = Supervisor([executable, "-c", child, str(sock.getsockname()[1]), *args], sock,
+								heartbeat_timeout=heartbeat_timeout, check_interval=0.1, max_backoff=0.5,
+								accept_timeout=accept_timeout)
+		frames = [0]
+		transports = []
+
+		def on_frame(kind, body):
+			frames[0] += 1
+			supervisor.beat()
+
+		async def attach(conn):
+			for transport in transports:
+				transport.close()
+			transport, _ = await get_running_loop().connect_accepted_socket(lambda: FrameProtocol(on_frame), sock=conn)
+			transports.append(transport)
+
+		return supervisor, attach, frames
+
+	async def soak(duration: float):
+		supervisor, attach, frames = supervised(CHILD)
+
+		async def killer():
+			while True:
+				await sleep(uniform(1, 2))
+				if supervisor.process.poll() is None:
+					supervisor.process.kill()
+
+		await supervisor.start(attach)
+		kill_task = get_running_loop().create_task(killer())
+
+		# Any blocking in the supervisor shows up as event loop lag
+		max_lag = await max_lag_during(lambda: sleep(duration))
+
+		kill_task.cancel()
+		supervisor.stop(SIGKILL)
+		print(f"{duration}s soak | {supervisor.restarts} restarts, {frames[0]} frames received, "
+			  f"max event loop lag {max_lag * 1000:.1f}ms, last handshake {supervisor.handshake_time:.2f}s, "
+			  f"healthy at end: {not supervisor.stalled}")
+
+	async def late_connect():
+		# The first child connects after its accept times out but before it counts as stalled, later ones straight away
+		supervisor, attach, frames = supervised(LATE_CHILD, "1.5", heartbeat_timeout=3, accept_timeout=1)
+		await supervisor.start(attach)
+		supervisor.command[-1] = "0"
+		await sleep(10)
+		supervisor.stop(SIGKILL)
+		print(f"Late connection | {supervisor.restarts} restarts, {frames[0]} frames received, "
+			  f"healthy at end: {not supervisor.stalled}")
+		assert supervisor.restarts == 1 and not supervisor.stalled, "accepted the late child's stale connection"
+
+	logging.basicConfig(level=logging.ERROR)
+	run(soak(20))
+	run(late_connect())